@@ -1,3 +1,9 @@
+import os
+import copy
+import glob
+import time
+import hashlib
+import concurrent.futures
 import numpy
 
 from scipy import interpolate
@@ -29,6 +35,12 @@ def write_generic_h5_surface(s, xx, yy, filename='presurface.hdf5',subgroup_name
     print("write_h5_surface: File for OASYS " + filename + " written to disk.")
 
 
+# directory of the node cache files of load_multicolumn_file(use_cache=True)
+NODE_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "fea_file")
+
+# mirror replication: nodes closer to a mirror axis than this fraction of the node spacing are on the axis
+MIRROR_AXIS_TOLERANCE = 1e-3
+
 class FEA_File():
     def __init__(self,filename=""):
         self.filename = filename
@@ -45,6 +57,12 @@ class FEA_File():
 
         self.triPi = None
         self.tri = None
+        self.interpolator = None
+        self._tri_offset = None # rescaling of the triangulated points (see triangulate)
+        self._tri_scale = None
+
+        self.mirror_flag = 0 # replication done on the interpolated data (see replicate_raw_data)
+        self.mirror_tolerance = 0.0 # distance to a mirror axis of the nodes on it
 
         self.x_interpolated = None  # 1D array
         self.y_interpolated = None  # 1D array
@@ -58,6 +76,7 @@ class FEA_File():
                      detrend=0, # 0=none 1(2)=straight line axis 0 (1), 3(4) best circle axis 0(1)
                      reset_height_method=0,
                      replicate_raw_data_flag=0, # 0=None, 1=axis0, 2=axis1, 3=both axis
+                     replicate_raw_data_mirror=False, # mirror the interpolated surface instead of replicating nodes
                      file_in_type=0,skiprows=0,
                      do_plot=False):
 
@@ -65,7 +84,7 @@ class FEA_File():
         o1.load_multicolumn_file(skiprows=skiprows,file_in_type=file_in_type)
 
 
-        o1.replicate_raw_data(replicate_raw_data_flag)
+        o1.replicate_raw_data(replicate_raw_data_flag, mirror=replicate_raw_data_mirror)
 
 
 
@@ -118,31 +137,44 @@ class FEA_File():
     def set_file_in_type(self, value):
         self.file_in_type = value
 
-    def load_multicolumn_file(self,skiprows=0,factorX=1.0,factorY=1.0,factorZ=1.0,file_in_type=0):
+    def load_multicolumn_file(self,skiprows=0,factorX=1.0,factorY=1.0,factorZ=1.0,file_in_type=0,use_cache=True):
         self.set_file_in_type(file_in_type)
+        self.invalidate_triangulation()
+        self.mirror_flag = 0
+        self.mirror_tolerance = 0.0
         print("Reading file/url: %s" % self.filename)
-        if file_in_type == 0: # ALS
-            node = numpy.loadtxt(self.filename, skiprows=skiprows, dtype=numpy.float64)
-
-            # Coordinates
-            self.Xundeformed = factorX * node[:, 1]  # X=x in m
-            self.Yundeformed = factorY * node[:, 2]  # Y=z in m
-            self.Zundeformed = factorZ * node[:, 3]  # Z=uy vertical displacement in m
-
-            self.Xdeformation = factorX * node[:, 4]  # X=x in m
-            self.Ydeformation = factorY * node[:, 5]  # Y=z in m
-            self.Zdeformation = factorZ * node[:, 6]  # Z=uy vertical displacement in m
-        elif file_in_type == 1: # ESRF
-            node = numpy.loadtxt(self.filename, skiprows=skiprows, dtype=numpy.float64, delimiter=',')
+        if file_in_type in (0, 1):
+            # parsed nodes are kept in a binary file in NODE_CACHE_DIRECTORY (use_cache=True, local files only)
+            cache_filename = ""
+            if use_cache and os.path.isfile(self.filename):
+                cache_filename = self._node_cache_filename(skiprows, file_in_type, (factorX, factorY, factorZ))
+
+            node = None
+            if cache_filename != "" and os.path.isfile(cache_filename):
+                try:
+                    node = numpy.load(cache_filename, mmap_mode="r")
+                    print("Nodes read from cache file: %s" % cache_filename)
+                except Exception as e:
+                    print("Cannot read cache file %s: %s" % (cache_filename, e))
+
+            if node is None:
+                if file_in_type == 0: # ALS
+                    columns = self._load_node_columns(skiprows=skiprows, delimiter=None, usecols=(1, 2, 3, 4, 5, 6))
+                else: # ESRF
+                    columns = self._load_node_columns(skiprows=skiprows, delimiter=',', usecols=(0, 1, 2, 3, 4, 5))
+                node = numpy.array([factorX * columns[0], factorY * columns[1], factorZ * columns[2],
+                                    factorX * columns[3], factorY * columns[4], factorZ * columns[5]])
+                if cache_filename != "":
+                    self._write_node_cache(cache_filename, node)
 
             # Coordinates
-            self.Xundeformed = factorX * node[:, 0]  # X=x in m
-            self.Yundeformed = factorY * node[:, 1]  # Y=z in m
-            self.Zundeformed = factorZ * node[:, 2]  # Z=uy vertical displacement in m
+            self.Xundeformed = node[0]  # X=x in m
+            self.Yundeformed = node[1]  # Y=z in m
+            self.Zundeformed = node[2]  # Z=uy vertical displacement in m
 
-            self.Xdeformation = factorX * node[:, 3]  # X=x in m
-            self.Ydeformation = factorY * node[:, 4]  # Y=z in m
-            self.Zdeformation = factorZ * node[:, 5]  # Z=uy vertical displacement in m
+            self.Xdeformation = node[3]  # X=x in m
+            self.Ydeformation = node[4]  # Y=z in m
+            self.Zdeformation = node[5]  # Z=uy vertical displacement in m
 
         elif file_in_type == 2: # HDF5 Oasys surface file
 
@@ -189,6 +221,63 @@ class FEA_File():
             self.y_interpolated = factorY * yy
             self.Z_INTERPOLATED = factorZ * ZZ
 
+    def _node_cache_filename(self, skiprows, file_in_type, factors):
+        """
+        Name of the cache file in NODE_CACHE_DIRECTORY for the given parse options: a hash of the path of the FEA
+        file, and a hash of its path, size and modification time and of the parse options.
+        """
+        filename = os.path.abspath(self.filename)
+        stat = os.stat(filename)
+        key = repr((filename, stat.st_size, stat.st_mtime_ns, skiprows, file_in_type, tuple(float(f) for f in factors)))
+        return os.path.join(NODE_CACHE_DIRECTORY, "%s.%s.npy" % (hashlib.sha1(filename.encode("utf-8")).hexdigest()[:16],
+                                                                 hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]))
+
+    @classmethod
+    def _write_node_cache(cls, cache_filename, node):
+        """
+        Writes the (6, nnodes) node array, and removes the cache files of older versions (or other parse options)
+        of the same FEA file. Errors (e.g. disk full) are reported and ignored: the nodes are loaded anyway.
+        """
+        prefix = cache_filename[:-len("0123456789abcdef.npy")]
+        try:
+            os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+            for old_filename in glob.glob(glob.escape(prefix) + "?" * 16 + ".npy"):
+                os.remove(old_filename)
+            with open(cache_filename + ".tmp", "wb") as f:
+                numpy.save(f, node)
+            os.replace(cache_filename + ".tmp", cache_filename)
+            print("Nodes written to cache file: %s" % cache_filename)
+        except Exception as e:
+            print("Cannot write cache file %s: %s" % (cache_filename, e))
+
+    def _load_node_columns(self, skiprows=0, delimiter=None, usecols=(0, 1, 2, 3, 4, 5), chunksize=1000000):
+        """
+        Reads the columns usecols of a text node file (delimiter=None: whitespace).
+
+        :return: a list with one float64 array per column.
+        """
+        t0 = time.time()
+        try:
+            import pandas
+        except ImportError:
+            node = numpy.loadtxt(self.filename, skiprows=skiprows, dtype=numpy.float64, delimiter=delimiter,
+                                 usecols=usecols)
+            columns = [node[:, i].copy() for i in range(len(usecols))]
+        else:
+            # C parser, only the needed columns, in chunks of rows
+            reader = pandas.read_csv(self.filename, skiprows=skiprows, header=None, comment="#",
+                                     sep=r"\s+" if delimiter is None else delimiter,
+                                     skipinitialspace=delimiter is not None, usecols=list(usecols),
+                                     dtype=numpy.float64, engine="c", chunksize=chunksize)
+            chunks = [chunk[list(usecols)].to_numpy(dtype=numpy.float64) for chunk in reader]
+            node = numpy.concatenate(chunks) if len(chunks) > 0 else numpy.zeros((0, len(usecols)))
+            columns = [numpy.ascontiguousarray(node[:, i]) for i in range(len(usecols))]
+
+        elapsed = time.time() - t0
+        nrows = columns[0].size
+        print("Read %d nodes in %.3f s (%.0f rows/s)" % (nrows, elapsed, nrows / elapsed if elapsed > 0 else 0.0))
+        return columns
+
     def Xdeformed(self):
         return self.Xundeformed + self.Xdeformation
 
@@ -241,7 +330,30 @@ class FEA_File():
     def get_dimensions(self):
         return self.Xundeformed.size, self.Yundeformed.size, self.Zundeformed.size
 
-    def replicate_raw_data(self,flag):
+    def replicate_raw_data(self,flag,mirror=False):
+        """
+
+        :param flag: 0=None, 1=axis0, 2=axis1, 3=both axis
+        :param mirror: if True, the nodes are not replicated: interpolate() uses the original nodes on one side of the
+                       axes and reflects the interpolated surface (requires nodes on one side of the mirror axes only,
+                       reaching the axes within MIRROR_AXIS_TOLERANCE times the node spacing, otherwise the nodes are
+                       replicated).
+        :return:
+        """
+
+        if flag != 0:
+            self.invalidate_triangulation()
+
+        if flag != 0 and mirror:
+            X, Y = self.Xdeformed(), self.Ydeformed()
+            tolerance = MIRROR_AXIS_TOLERANCE * self._node_spacing()
+            mirror_x = (X.min() >= -tolerance or X.max() <= tolerance) and numpy.abs(X).min() <= tolerance
+            mirror_y = (Y.min() >= -tolerance or Y.max() <= tolerance) and numpy.abs(Y).min() <= tolerance
+            if (flag == 2 or mirror_x) and (flag == 1 or mirror_y):
+                self.mirror_flag = flag
+                self.mirror_tolerance = tolerance
+                return
+            print("Nodes on both sides of the mirror axes, or not on the axes: replicating the nodes")
 
         if flag == 0: # nothing
             return
@@ -275,10 +387,49 @@ class FEA_File():
             self.Zdeformation = numpy.concatenate((self.Zdeformation, self.Zdeformation))
 
 
+    def _node_spacing(self, npoints=10000):
+        """
+        Median distance of the (deformed) nodes to their nearest neighbour, on at most about npoints nodes.
+        """
+        P = numpy.array([self.Xdeformed(), self.Ydeformed()]).transpose()
+        distance, _ = spatial.cKDTree(P).query(P[::max(1, P.shape[0] // npoints)], k=2)
+        return numpy.median(distance[:, 1])
+
     def triangulate(self):
+        # the triangulation is kept until the raw data change (see invalidate_triangulation)
+        if self.tri is not None:
+            return
+
         # triangulation
         self.triPi = numpy.array([self.Xdeformed(), self.Ydeformed()]).transpose()
-        self.tri = spatial.Delaunay(self.triPi)
+
+        # points rescaled as in griddata(rescale=True): centered and normalized to their range
+        self._tri_offset = self.triPi.mean(axis=0)
+        self._tri_scale = numpy.ptp(self.triPi, axis=0)
+        # with mirror replication, use the (symmetric) extent of the replicated nodes, so that the triangulation of
+        # the original nodes is the one they have in the replicated mesh
+        for axis in {1: (0,), 2: (1,), 3: (0, 1)}.get(self.mirror_flag, ()):
+            self._tri_offset[axis] = 0.0
+            self._tri_scale[axis] = 2 * numpy.abs(self.triPi[:, axis]).max()
+        self._tri_scale[~(self._tri_scale > 0)] = 1.0
+        self.tri = spatial.Delaunay((self.triPi - self._tri_offset) / self._tri_scale)
+
+    def invalidate_triangulation(self):
+        self.triPi = None
+        self.tri = None
+        self.interpolator = None
+        self._tri_offset = None
+        self._tri_scale = None
+
+    def get_interpolator(self):
+        """
+        Cubic (Clough-Tocher) interpolator of Zdeformed on the triangulation, built once and reused by interpolate()
+        for any grid. It takes the rescaled coordinates (x - self._tri_offset) / self._tri_scale.
+        """
+        if self.interpolator is None:
+            self.triangulate()
+            self.interpolator = interpolate.CloughTocher2DInterpolator(self.tri, self.Zdeformed())
+        return self.interpolator
 
     def plot_triangulation(self,show=True):
         fig = plt.figure()
@@ -300,12 +451,15 @@ class FEA_File():
         return numpy.outer(numpy.ones_like(self.x_interpolated),self.y_interpolated)
 
 
-    def interpolate(self,nx,ny,remove_nan=0):
+    def interpolate(self,nx,ny,remove_nan=0,n_workers=1,tile_size=0):
         """
 
         :param nx:
         :param ny:
         :param remove_nan: 0=No, 1=Yes (replace with minimum height) 2=Yes (replace with 0)
+        :param n_workers: number of threads evaluating the tiles of the grid (FEA files only)
+        :param tile_size: if > 0 (or n_workers > 1), the grid is evaluated in tiles of tile_size x tile_size points
+                          (256 if 0), without building the full list of grid points (FEA files only)
         :return:
         """
 
@@ -340,26 +494,109 @@ class FEA_File():
         else:
 
 
-            if self.tri is None:
-                self.triangulate()
+            interpolator = self.get_interpolator()
 
-            lim = self.get_limits_deformed()
+            lim = list(self.get_limits_deformed())
+            # limits of the replicated nodes
+            if self.mirror_flag in (1, 3):
+                lim[1] = max(numpy.abs(lim[0]), numpy.abs(lim[1]))
+                lim[0] = -lim[1]
+            if self.mirror_flag in (2, 3):
+                lim[3] = max(numpy.abs(lim[2]), numpy.abs(lim[3]))
+                lim[2] = -lim[3]
             self.x_interpolated = numpy.linspace(lim[0],lim[1],nx)
             self.y_interpolated = numpy.linspace(lim[2],lim[3],ny)
 
-            X_INTERPOLATED =  self.get_Xinterpolated_mesh()
-            Y_INTERPOLATED =  self.get_Yinterpolated_mesh()
+            if self.mirror_flag != 0:
+                self.P = None
+                self.Z_INTERPOLATED = self._interpolate_mirrored(interpolator, n_workers=n_workers, tile_size=tile_size)
+            elif n_workers <= 1 and tile_size <= 0:
+                X_INTERPOLATED =  self.get_Xinterpolated_mesh()
+                Y_INTERPOLATED =  self.get_Yinterpolated_mesh()
 
-            self.P = numpy.array([X_INTERPOLATED.flatten(), Y_INTERPOLATED.flatten() ]).transpose()
+                self.P = numpy.array([X_INTERPOLATED.flatten(), Y_INTERPOLATED.flatten() ]).transpose()
+
+                # same result as griddata(self.triPi, self.Zdeformed(), self.P, rescale=True, method="cubic"), without
+                # triangulating again
+                self.Z_INTERPOLATED = interpolator((self.P - self._tri_offset) / self._tri_scale).reshape([nx, ny])
+            else:
+                self.P = None
+                self.Z_INTERPOLATED = self._interpolate_tiles(interpolator, self.x_interpolated, self.y_interpolated,
+                                                              n_workers=n_workers,
+                                                              tile_size=tile_size if tile_size > 0 else 256)
 
             if remove_nan ==2:
-                self.Z_INTERPOLATED = interpolate.griddata(self.triPi, self.Zdeformed(), self.P, rescale=True, method = "cubic", fill_value=0.0 ).reshape([nx,ny])
+                self.Z_INTERPOLATED[numpy.isnan(self.Z_INTERPOLATED)] = 0.0
             elif remove_nan ==1:
-                self.Z_INTERPOLATED = interpolate.griddata(self.triPi, self.Zdeformed(), self.P, rescale=True, method = "cubic", fill_value=self.Zdeformed().min() ).reshape([nx,ny])
-            elif remove_nan == 0:
-                self.Z_INTERPOLATED = interpolate.griddata(self.triPi, self.Zdeformed(), self.P, rescale=True, method="cubic").reshape([nx, ny])
+                self.Z_INTERPOLATED[numpy.isnan(self.Z_INTERPOLATED)] = self.Zdeformed().min()
 
 
+    def _interpolate_mirrored(self, interpolator, n_workers=1, tile_size=0):
+        """
+        Interpolated surface for the mirror replication (self.mirror_flag): the interpolator (original nodes) is only
+        evaluated on the part of the grid on the side of the nodes, and the other part is its reflection. The grid is
+        symmetric, so the point i of an axis of n points is the reflection of the point n - 1 - i. The grid points
+        between the axis and the nodes on it (at most self.mirror_tolerance away) are moved onto these nodes: the
+        surface is symmetric, so its slope across the axis is zero.
+        """
+        x = self.x_interpolated
+        y = self.y_interpolated
+        ix = numpy.arange(x.size)
+        iy = numpy.arange(y.size)
+        sign_x = 1.0
+        sign_y = 1.0
+        x_axis = -numpy.inf
+        y_axis = -numpy.inf
+        if self.mirror_flag in (1, 3):
+            ix = numpy.maximum(ix, x.size - 1 - ix) # index on the positive side
+            X = self.Xdeformed()
+            if X.max() <= self.mirror_tolerance: sign_x = -1.0 # nodes on the negative side
+            x_axis = numpy.abs(X)[numpy.abs(X) <= self.mirror_tolerance].max()
+        if self.mirror_flag in (2, 3):
+            iy = numpy.maximum(iy, y.size - 1 - iy)
+            Y = self.Ydeformed()
+            if Y.max() <= self.mirror_tolerance: sign_y = -1.0
+            y_axis = numpy.abs(Y)[numpy.abs(Y) <= self.mirror_tolerance].max()
+
+        x0 = ix.min()
+        y0 = iy.min()
+        if tile_size <= 0:
+            tile_size = 256 if n_workers > 1 else max(x.size - x0, y.size - y0)
+        Z_HALF = self._interpolate_tiles(interpolator, sign_x * numpy.maximum(x[x0:], x_axis),
+                                         sign_y * numpy.maximum(y[y0:], y_axis), n_workers=n_workers,
+                                         tile_size=tile_size)
+        return Z_HALF[numpy.ix_(ix - x0, iy - y0)]
+
+    def _interpolate_tiles(self, interpolator, x, y, n_workers=1, tile_size=256):
+        """
+        Evaluates the interpolator on the grid (x, y) tile by tile, in a thread pool if n_workers > 1 (the
+        interpolator releases the GIL, and the triangulation is shared by the threads). Each tile is written in place
+        in the returned (x.size, y.size) array.
+        """
+        nx = x.size
+        ny = y.size
+        Z_INTERPOLATED = numpy.empty((nx, ny))
+
+        # rescaled coordinates (see get_interpolator)
+        x = (x - self._tri_offset[0]) / self._tri_scale[0]
+        y = (y - self._tri_offset[1]) / self._tri_scale[1]
+
+        def interpolate_tile(tile):
+            i, j = tile
+            xt, yt = numpy.meshgrid(x[i:i + tile_size], y[j:j + tile_size], indexing="ij")
+            Z_INTERPOLATED[i:i + tile_size, j:j + tile_size] = interpolator(xt, yt)
+
+        tiles = [(i, j) for i in range(0, nx, tile_size) for j in range(0, ny, tile_size)]
+        print("Interpolating %d x %d points in %d tiles (%d threads)" % (nx, ny, len(tiles), max(1, n_workers)))
+        if n_workers > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+                list(executor.map(interpolate_tile, tiles))
+        else:
+            for tile in tiles:
+                interpolate_tile(tile)
+
+        return Z_INTERPOLATED
+
     def plot_interpolated(self, show=True):
         fig = plt.figure()
         plt.contourf(self.get_Xinterpolated_mesh(), self.get_Yinterpolated_mesh(), self.Z_INTERPOLATED, 50, cmap = mpl.cm.jet)
@@ -504,6 +741,85 @@ class FEA_File():
         self.Z_INTERPOLATED = gaussian_filter(self.Z_INTERPOLATED, (sigma_axis0,sigma_axis1),
                         order=0, output=None, mode='nearest', cval=0.0, truncate=4.0)
 
+def compare_mirror_and_replication(fea_file_object, flag, nx=201, ny=101, axis_margin=0.25, replicated_object=None):
+    """
+    Interpolates the raw data of fea_file_object (not modified) with replicate_raw_data(flag) and with
+    replicate_raw_data(flag, mirror=True). If replicated_object is given, its raw data are used for
+    replicate_raw_data(flag) instead.
+
+    :return: the maximum absolute difference of the two surfaces outside a band of axis_margin (fraction of the half
+             width) around the mirror axes, and everywhere (infinite if the surfaces have NaNs at different points),
+             and the mirror_flag used by replicate_raw_data(flag, mirror=True).
+    """
+    surfaces = []
+    for mirror in (False, True):
+        o = copy.copy(fea_file_object if mirror or replicated_object is None else replicated_object)
+        o.invalidate_triangulation()
+        o.mirror_flag = 0
+        o.replicate_raw_data(flag, mirror=mirror)
+        o.interpolate(nx, ny)
+        surfaces.append(o)
+
+    nan0 = numpy.isnan(surfaces[0].Z_INTERPOLATED)
+    nan1 = numpy.isnan(surfaces[1].Z_INTERPOLATED)
+    diff = numpy.where(nan0 | nan1, numpy.where(nan0 == nan1, 0.0, numpy.inf),
+                       numpy.abs(surfaces[0].Z_INTERPOLATED - surfaces[1].Z_INTERPOLATED))
+    x = numpy.abs(surfaces[1].x_interpolated)
+    y = numpy.abs(surfaces[1].y_interpolated)
+    outside = numpy.ones_like(diff, dtype=bool)
+    if flag in (1, 3):
+        outside &= (x >= axis_margin * x.max())[:, numpy.newaxis]
+    if flag in (2, 3):
+        outside &= (y >= axis_margin * y.max())[numpy.newaxis, :]
+    return diff[outside].max(), diff.max(), surfaces[1].mirror_flag
+
+def check_mirror_replication(tolerance=1e-5):
+    """
+    Compares the mirror and the node replication (flags 1, 2 and 3) on synthetic irregular meshes with nodes on the
+    mirror axes (exactly, or within MIRROR_AXIS_TOLERANCE times the node spacing: compared with the node replication
+    of the nodes exactly on the axes, as the replication of nodes near the axes creates sliver triangles), and with
+    nodes off the axes, for which the nodes must be replicated. Raises an exception if the relative difference away from the axes is larger
+    than tolerance, or if the surfaces have NaNs at different points.
+    """
+    rng = numpy.random.default_rng(0)
+    # (name, shift of the nodes away from the axes, mirror replication expected)
+    for name, shift, mirror_expected in (("on the axes", 0.0, True),
+                                         ("near the axes", 1e-9, True),
+                                         ("off the axes", 3.8e-5, False)):
+        for flag in (1, 2, 3):
+            xg = numpy.linspace(0, 0.4, 61) if flag != 2 else numpy.linspace(-0.4, 0.4, 121)
+            yg = numpy.linspace(0, 0.02, 21) if flag != 1 else numpy.linspace(-0.02, 0.02, 41)
+            x, y = [a.ravel() for a in numpy.meshgrid(xg, yg, indexing="ij")]
+            # irregular interior nodes, the border nodes are kept
+            x = x + numpy.where((x != xg[0]) & (x != xg[-1]), rng.uniform(-1e-3, 1e-3, x.size), 0.0)
+            y = y + numpy.where((y != yg[0]) & (y != yg[-1]), rng.uniform(-5e-5, 5e-5, y.size), 0.0)
+
+            objects = []
+            for shifted in (False, True):
+                o = FEA_File()
+                o.file_in_type = 0
+                o.Xundeformed = x + shift if shifted and flag != 2 else x
+                o.Yundeformed = y + shift * 0.02 / 0.4 if shifted and flag != 1 else y
+                o.Zundeformed = numpy.zeros_like(x)
+                o.Xdeformation, o.Ydeformation = numpy.zeros_like(x), numpy.zeros_like(y)
+                o.Zdeformation = 1e-6 * (numpy.cos(3 * o.Xundeformed) * numpy.cos(40 * o.Yundeformed) +
+                                         o.Xundeformed ** 2)
+                objects.append(o)
+
+            diff_outside, diff, mirror_flag = compare_mirror_and_replication(
+                objects[1], flag, replicated_object=objects[0] if mirror_expected else None)
+            scale = numpy.abs(o.Zdeformation).max()
+            print("Mirror vs node replication, nodes %s, flag %d: max relative difference %g (away from the axes), "
+                  "%g (all)%s" % (name, flag, diff_outside / scale, diff / scale,
+                                  "" if mirror_flag != 0 else ", nodes replicated"))
+            if (mirror_flag != 0) != mirror_expected:
+                raise Exception("Mirror replication %s for nodes %s, flag %d" %
+                                ("used" if mirror_flag != 0 else "not used", name, flag))
+            if not diff < numpy.inf:
+                raise Exception("Mirror and node replication have NaNs at different points for flag %d" % flag)
+            if diff_outside > tolerance * scale:
+                raise Exception("Mirror and node replication differ for flag %d" % flag)
+
 def surface_plot(xs,ys,zs):
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
@@ -525,6 +841,8 @@ def surface_plot(xs,ys,zs):
 
 if __name__ == "__main__":
 
+    check_mirror_replication()
+
 
 
 
@@ -75,6 +75,7 @@ class FiniteElementReader(OWWidget):
 
     file_in_skiprows = Setting(0)
     replicate_raw_data_flag = Setting(0)
+    replicate_raw_data_mirror = Setting(0)
 
     file_out = Setting("")
     n_axis_0 = Setting(801)
@@ -100,6 +101,8 @@ class FiniteElementReader(OWWidget):
     def __init__(self, show_automatic_box=False):
         super().__init__()
 
+        self.raw_data_parameters = None # parameters of the raw data loaded in fea_file_object (see load_raw_data)
+
         geom = QApplication.primaryScreen().availableGeometry()
         self.setGeometry(QRect(round(geom.width() * 0.05),
                                round(geom.height() * 0.05),
@@ -150,6 +153,10 @@ class FiniteElementReader(OWWidget):
                      items=["No", "Along axis 0", "Along axis 1", "Along axes 0 and 1"],
                      sendSelectedValue=False, orientation="horizontal")
 
+        gui.comboBox(data_file_box, self, "replicate_raw_data_mirror", label="Replication method", labelWidth=220,
+                     items=["Replicate nodes", "Mirror interpolated surface"],
+                     sendSelectedValue=False, orientation="horizontal")
+
         interpolation_box = oasysgui.widgetBox(tab_calc, "Interpolation", addSpace=True, orientation="vertical")
         interpolation_box2 = oasysgui.widgetBox(interpolation_box, "", addSpace=False, orientation="horizontal")
 
@@ -272,12 +279,25 @@ class FiniteElementReader(OWWidget):
         self.set_file_out()
 
     def load_raw_data(self):
+        # the raw data (and their triangulation) are reused if the file and the reading options did not change. The
+        # OASYS h5 surfaces are always read again, as interpolate() overwrites them.
+        raw_data_parameters = (self.file_in,
+                               os.path.getmtime(self.file_in) if os.path.isfile(self.file_in) else None,
+                               self.file_in_type, self.file_in_skiprows,
+                               self.file_factor_x, self.file_factor_y, self.file_factor_z,
+                               self.replicate_raw_data_flag, self.replicate_raw_data_mirror)
+        if self.file_in_type != 2 and raw_data_parameters == self.raw_data_parameters:
+            print("Using raw data and triangulation of the previous calculation")
+            return
+        self.raw_data_parameters = None
+
         self.fea_file_object = FEA_File()
         self.fea_file_object.set_filename(self.file_in)
 
         self.fea_file_object.load_multicolumn_file(skiprows=self.file_in_skiprows, file_in_type=self.file_in_type, factorX=self.file_factor_x, factorY=self.file_factor_y, factorZ=self.file_factor_z)
 
-        self.fea_file_object.replicate_raw_data(self.replicate_raw_data_flag)
+        self.fea_file_object.replicate_raw_data(self.replicate_raw_data_flag, mirror=self.replicate_raw_data_mirror == 1)
+        self.raw_data_parameters = raw_data_parameters
 
     def writeStdOut(self, text="", initialize=False):
         cursor = self.info_id.textCursor()
@@ -306,7 +326,8 @@ class FiniteElementReader(OWWidget):
         if self.file_in_type == 2:
             self.fea_file_object.interpolate(self.n_axis_0, self.n_axis_1, remove_nan=self.remove_nan)
         else:
-            self.fea_file_object.interpolate(self.n_axis_0 + 3, self.n_axis_1 + 3, remove_nan=self.remove_nan)
+            self.fea_file_object.interpolate(self.n_axis_0 + 3, self.n_axis_1 + 3, remove_nan=self.remove_nan,
+                                             n_workers=os.cpu_count() or 1)
 
         if self.fea_file_object.does_interpolated_have_nan():
             self.fea_file_object.remove_borders_in_interpolated_data()
@@ -7,13 +7,38 @@ import numpy
 import mpmath
 import scipy
 import time
+import copy
+import functools
+import concurrent.futures
+import multiprocessing
+import contextlib
+import itertools
+import io
+import os
+import json
+import hashlib
+import cmath
+import h5py
 
 from scipy.special import jv as BesselJ
+from scipy.special import gamma as gamma_function
+from scipy.special import rgamma
+from scipy.special import roots_legendre
+from numpy.polynomial.polynomial import polyval, polyder
 import scipy.constants as codata
 from scipy import interpolate
+from scipy.integrate import trapezoid
+from scipy.signal import czt
+from scipy.optimize import minimize_scalar
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 from srxraylib.plot.gol import plot, set_qt, plot_show
 from wofry.propagator.wavefront1D.generic_wavefront import GenericWavefront1D
+from wofry.propagator.wavefront2D.generic_wavefront import GenericWavefront2D
 
 
 
@@ -50,6 +75,580 @@ def fast_hyp1f1(kap, yprime):
         # Original for medium range
         return mpmath.hyp1f1(1j * kap, 1, 1j * yprime)
 
+#
+# vectorized Kummer function M(a, b, z) for a=1j*kap, b=1, z=1j*yprime (yprime real)
+#
+_HYP1F1_EPS = 1e-17
+_HYP1F1_MAX_TERMS = 500
+_HYP1F1_ASYMPTOTIC_TERMS = 60
+
+def _hyp1f1_series(a, b, z):
+    """Power series of M(a, b, z) around z=0, for an array z"""
+    result = numpy.ones_like(z)
+    term = numpy.ones_like(z)
+    for n in range(1, _HYP1F1_MAX_TERMS):
+        term = term * (a + n - 1) * z / ((b + n - 1) * n)
+        result += term
+        if numpy.all(numpy.abs(term) <= _HYP1F1_EPS * numpy.abs(result)):
+            break
+    return result
+
+def _hyp1f1_asymptotic(a, b, z):
+    """
+    Asymptotic expansion of M(a, b, z) for large |z| (DLMF 13.7.2), for an array z on the imaginary axis.
+    Returns the values and a mask with the elements for which both series converged to machine precision.
+    """
+    s1 = numpy.ones_like(z)
+    s2 = numpy.ones_like(z)
+    t1 = numpy.ones_like(z)
+    t2 = numpy.ones_like(z)
+    active = numpy.ones(z.shape, dtype=bool)
+    for n in range(_HYP1F1_ASYMPTOTIC_TERMS):
+        t1 = t1 * (b - a + n) * (1 - a + n) / ((n + 1) * z)
+        t2 = t2 * (a + n) * (a - b + n + 1) / ((n + 1) * (-z))
+        s1[active] += t1[active]
+        s2[active] += t2[active]
+        active &= ~((numpy.abs(t1) <= _HYP1F1_EPS * numpy.abs(s1)) & (numpy.abs(t2) <= _HYP1F1_EPS * numpy.abs(s2)))
+        if not numpy.any(active): break
+
+    sign = numpy.where(z.imag >= 0, 1, -1)
+    value = gamma_function(b) * (numpy.exp(z) * z ** (a - b) * rgamma(a) * s1 + \
+                                 numpy.exp(sign * 1j * numpy.pi * a) * z ** (-a) * rgamma(b - a) * s2)
+    return value, ~active
+
+def _hyp1f1_taylor_coefficients(a, b, z0, m0, dm0, h):
+    """
+    Taylor coefficients of M(a, b, z0 + t), from M(z0)=m0 and M'(z0)=dm0, using the recurrence that follows
+    from the Kummer equation z M'' + (b - z) M' - a M = 0. The series is truncated for |t| <= h.
+    """
+    c = [m0, dm0]
+    scale = max(abs(m0), abs(dm0) * h)
+    hn = h
+    nsmall = 0
+    for n in range(_HYP1F1_MAX_TERMS):
+        c.append(((n + a) * c[n] - (n + 1) * (n + b - z0) * c[n + 1]) / (z0 * (n + 2) * (n + 1)))
+        hn *= h
+        term = abs(c[-1]) * hn
+        scale = max(scale, term)
+        if term <= _HYP1F1_EPS * scale:
+            nsmall += 1
+            if nsmall == 2: break
+        else:
+            nsmall = 0
+    return numpy.array(c)
+
+def _hyp1f1_march(a, b, z, direction, r0):
+    """
+    M(a, b, z) for points z on the ray direction*[r0, inf), sorted by |z|. Starts from the power series at
+    |z|=r0 and steps along the ray with Taylor series, evaluating the points falling in each step.
+    """
+    out = numpy.zeros_like(z)
+    absz = numpy.abs(z)
+    c = abs(0.5 * b - a) # the local oscillation wavenumber is ~ sqrt(c/|z|) + 1
+
+    z0 = direction * r0
+    m0 = _hyp1f1_series(a, b, numpy.array([z0]))[0]
+    dm0 = a / b * _hyp1f1_series(a + 1, b + 1, numpy.array([z0]))[0]
+
+    pos = 0
+    while pos < z.size:
+        r = abs(z0)
+        h = min(0.5 * r, 2.0 / (numpy.sqrt(c / r) + 1.0))
+        coeffs = _hyp1f1_taylor_coefficients(a, b, z0, m0, dm0, h)
+        end = numpy.searchsorted(absz, r + h, side='right')
+        out[pos:end] = polyval(z[pos:end] - z0, coeffs)
+        pos = end
+        t = direction * h
+        m0 = polyval(t, coeffs)
+        dm0 = polyval(t, polyder(coeffs))
+        z0 = z0 + t
+    return out
+
+def hyp1f1_array(kap, yprime):
+    """
+    Vectorized replacement for mpmath.hyp1f1(1j*kap, 1, 1j*yprime), with kap a (complex) scalar and yprime an
+    array of real values (any shape).
+
+    Each element is evaluated with the method that suits its argument:
+      - |yprime| <= 1/(1+|kap|): power series around z=0.
+      - |yprime| >= max(40, 2(1+|kap|)^2): asymptotic expansion (DLMF 13.7.2), where it converges to machine precision.
+      - otherwise: Taylor series stepped along the imaginary axis, with coefficients computed by recurrence
+        from the Kummer differential equation.
+
+    Accuracy: compared with mpmath.hyp1f1 (30 digits), the maximum relative error is below 1e-13 for |kap| <= 15
+    and |yprime| <= 1000, and below 1e-12 for |kap| <= 100 (|Im(kap)| <= 1) and |yprime| <= 1000. This covers the
+    Guigay & Ferrero configurations (e.g. kap=-5.5+0.06j, yprime in [-12.2, 0] for Fig. 5 and kap=13.6-0.007j,
+    yprime in [0, 4.9] for Fig. 2).
+    """
+    yprime = numpy.asarray(yprime, dtype=float)
+    y = yprime.reshape(-1)
+    a = 1j * kap
+    b = 1.0
+    z = 1j * y.astype(complex)
+    out = numpy.zeros_like(z)
+
+    r0 = 1.0 / (1.0 + abs(a))
+    yasym = max(40.0, 2 * (abs(a) + 1) ** 2)
+
+    iseries = numpy.abs(y) <= r0
+    if numpy.any(iseries):
+        out[iseries] = _hyp1f1_series(a, b, z[iseries])
+    todo = ~iseries
+
+    iasym = numpy.flatnonzero(numpy.abs(y) >= yasym)
+    if iasym.size > 0:
+        with numpy.errstate(all='ignore'):
+            value, converged = _hyp1f1_asymptotic(a, b, z[iasym])
+        out[iasym[converged]] = value[converged]
+        todo[iasym[converged]] = False
+
+    for sign in (1, -1):
+        idx = numpy.flatnonzero(todo & (sign * y > 0))
+        if idx.size == 0: continue
+        idx = idx[numpy.argsort(numpy.abs(y[idx]))]
+        out[idx] = _hyp1f1_march(a, b, z[idx], sign * 1j, r0)
+
+    return out.reshape(yprime.shape)
+
+class KummerTable():
+    """
+    Tabulation of hyp1f1(1j*kap, 1, 1j*yprime) for yprime in [ymin, ymax], served by complex cubic spline
+    interpolation. Starting from a uniform grid, the intervals where the interpolation error at the midpoint
+    exceeds tolerance (relative to the function value) are bisected until all of them pass.
+    """
+    def __init__(self, kap, ymin, ymax, tolerance=1e-8, function=hyp1f1_array, npoints_initial=33, npoints_max=2**16):
+        self._kap = kap
+        self._ymin = ymin
+        self._ymax = ymax
+        self._tolerance = tolerance
+
+        y = numpy.linspace(ymin, ymax, npoints_initial)
+        m = function(kap, y)
+        while True:
+            spline = interpolate.CubicSpline(y, m)
+            ym = 0.5 * (y[1:] + y[:-1])
+            mm = function(kap, ym)
+            error = numpy.abs(spline(ym) - mm) / numpy.abs(mm)
+            bad = numpy.flatnonzero(error > tolerance)
+            if bad.size == 0:
+                break
+            if y.size + bad.size > npoints_max:
+                print("KummerTable: tolerance %g not reached with %d points (error: %g)" % (tolerance, y.size, error.max()))
+                break
+            y = numpy.insert(y, bad + 1, ym[bad])
+            m = numpy.insert(m, bad + 1, mm[bad])
+
+        self._spline = spline
+        self._npoints = y.size
+        self._max_error = error.max()
+
+    def __call__(self, yprime):
+        return self._spline(yprime)
+
+    def is_valid_for(self, kap, ymin, ymax, tolerance):
+        return kap == self._kap and tolerance == self._tolerance and \
+               ymin >= self._ymin and ymax <= self._ymax
+
+    def contains(self, yprime):
+        return (yprime >= self._ymin) & (yprime <= self._ymax)
+
+    def info(self):
+        return "KummerTable: kap=%s, yprime in [%g, %g], %d points, max relative error at midpoints: %g" % \
+               (complex(self._kap), self._ymin, self._ymax, self._npoints, self._max_error)
+
+# adaptive Gauss-Legendre integration
+_QUADRATURE_MIN_POINTS = 16
+_QUADRATURE_MAX_POINTS = 8192
+
+@functools.lru_cache(maxsize=None)
+def _legendre_roots(npoints):
+    return roots_legendre(npoints)
+
+# trapezoidal rule weights for the abscissas v
+def _trapezoid_weights(v):
+    weights = numpy.zeros_like(v)
+    weights[:-1] += 0.5 * numpy.diff(v)
+    weights[1:] += 0.5 * numpy.diff(v)
+    return weights
+
+# sum_j f_j exp(1j * alpha * x_m * v_j) for all equally spaced x_m and v_j, as a chirp-z transform (zoom FFT)
+def _fourier_sum_czt(f, v, alpha, xx):
+    dv = v[1] - v[0] if v.size > 1 else 0.0
+    dx = xx[1] - xx[0] if xx.size > 1 else 0.0
+    m = numpy.arange(xx.size)
+    # exp(i alpha x_m v_j) = exp(i alpha x_0 v_j) exp(i alpha m dx v_0) exp(i alpha dx dv m j)
+    out = czt(f * numpy.exp(1j * alpha * xx[0] * v), m=xx.size, w=numpy.exp(1j * alpha * dx * dv), a=1.0)
+    return out * numpy.exp(1j * alpha * dx * v[0] * m)
+
+# trapezoidal rule weights for every other abscissa v (and the last one), zero elsewhere: with the weights of
+# _trapezoid_weights(v), the difference of both sums / 3 estimates the integration error (Richardson)
+def _coarse_trapezoid_weights(v):
+    icoarse = numpy.unique(numpy.append(numpy.arange(0, v.size, 2), v.size - 1))
+    weights = numpy.zeros_like(v)
+    weights[icoarse] = _trapezoid_weights(v[icoarse])
+    return weights
+
+#
+# compiled sums over v for all x (engine="numba"). Both the sums with the weighted profiles g and gc are returned.
+#
+# The compiled kernels are cached on disk (__pycache__, or a user cache directory if not writable), so they are compiled
+# once, and not again in each process of the pool (n_workers > 1) or in each session.
+#
+if numba is not None:
+    _njit = numba.njit(parallel=True, cache=True)
+    _prange = numba.prange
+else:
+    _njit = lambda function: function
+    _prange = range
+
+# sum_j g_j cos(alpha x v_j + shift_j) (equations 24 and 31)
+@_njit
+def _cosine_sums_numba(xx, v, g, gc, alpha, shift):
+    out = numpy.zeros(xx.size, dtype=numpy.complex128)
+    out_coarse = numpy.zeros(xx.size, dtype=numpy.complex128)
+    for i in _prange(xx.size):
+        total = 0j
+        total_coarse = 0j
+        for j in range(v.size):
+            c = cmath.cos(alpha * xx[i] * v[j] + shift[j])
+            total += g[j] * c
+            total_coarse += gc[j] * c
+        out[i] = total
+        out_coarse[i] = total_coarse
+    return out, out_coarse
+
+# sum_j g_j exp(i k Q(x, v_j)) (equation 30)
+@_njit
+def _equation30_sums_numba(xx, v, g, gc, k, gamma, pe, mu1, R, t1_sin_teta1, a2, omega, gg, a):
+    out = numpy.zeros(xx.size, dtype=numpy.complex128)
+    out_coarse = numpy.zeros(xx.size, dtype=numpy.complex128)
+    for i in _prange(xx.size):
+        x = xx[i]
+        total = 0j
+        total_coarse = 0j
+        for j in range(v.size):
+            Q1 = gamma**2 * (x - v[j])**2 / (2 * pe)
+            Q2 = -(mu1 * x**2) / (2 * R)
+            Q3 = -(x * t1_sin_teta1 - a2 * gamma * (v[j] - x)) / (2 * R)
+            Q4 = v[j] * omega + gg * (a + x) * (v[j] - x) / R
+            e = cmath.exp(1j * k * (Q1 + Q2 + Q3 + Q4))
+            total += g[j] * e
+            total_coarse += gc[j] * e
+        out[i] = total
+        out_coarse[i] = total_coarse
+    return out, out_coarse
+
+# parameters of LaueCrystalFocusing.sweep()
+SWEEP_PARAMETERS = ("crystal_descriptor", "hkl", "R", "poisson_ratio", "photon_energy_in_keV", "thickness", "p",
+                    "alfa_deg")
+
+# start method of the process pool: "spawn", as forking a parent that already started threads (e.g. the numba
+# threading layer after an engine="numba" scan) can hang the workers or the interpreter at exit
+# (with "spawn", scripts using n_workers > 1 need the usual if __name__ == "__main__": guard)
+_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+# used to run LaueCrystalFocusing methods in a process pool
+def _call_method(instance, method_name, *args, **kwds):
+    return getattr(instance, method_name)(*args, **kwds)
+
+#
+# per-phase timers of LaueCrystalFocusing (profile=True). The times are exclusive: the time of a nested phase
+# (e.g. the kernel inside the integration) is only added to the nested phase.
+#
+PROFILE_PHASES = ("constants", "kernel", "integration", "io")
+
+_NULL_TIMER = contextlib.nullcontext()
+
+# number of blocks of a scan written to a LaueScanH5Stream. It does not depend on n_workers, so that an interrupted
+# scan can be resumed with any number of workers (4 blocks per worker up to 16 workers).
+_STREAM_BLOCKS = 64
+
+class _PhaseTimer():
+    def __init__(self, profile, stack, phase):
+        self._profile = profile
+        self._stack = stack
+        self._phase = phase
+
+    def __enter__(self):
+        self._stack.append(0.0)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._t0
+        nested = self._stack.pop()
+        record = self._profile.setdefault(self._phase, [0.0, 0])
+        record[0] += elapsed - nested
+        record[1] += 1
+        if len(self._stack) > 0:
+            self._stack[-1] += elapsed
+        return False
+
+# decorator: times a LaueCrystalFocusing method as phase
+def _timed(phase):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwds):
+            with self._timer(phase):
+                return method(self, *args, **kwds)
+        return wrapper
+    return decorator
+
+# xraylib data for a crystal reflection, memoized across LaueCrystalFocusing instances
+CRYSTAL_DATA_CACHE_SIZE = 128
+
+@functools.lru_cache(maxsize=CRYSTAL_DATA_CACHE_SIZE)
+def _get_crystal_data(crystal_descriptor, hkl, photon_energy_in_keV):
+    import xraylib
+    #
+    # get crystal data for silicon crystal
+    #
+    cryst = xraylib.Crystal_GetCrystal(crystal_descriptor)
+
+    #
+    # define miller indices and compute dSpacing
+    #
+
+    hh = hkl[0]
+    kk = hkl[1]
+    ll = hkl[2]
+    debyeWaller = 1.0
+    rel_angle = 1.0  # ratio of (incident angle)/(bragg angle) -> we work at Bragg angle
+
+    dspacing = xraylib.Crystal_dSpacing(cryst, hh, kk, ll)
+    #
+    # define energy and get Bragg angle
+    #
+    ener = photon_energy_in_keV  # 12.398 # keV
+    braggAngle = xraylib.Bragg_angle(cryst, ener, hh, kk, ll)
+
+    #
+    # get the structure factor (at a given energy)
+    #
+    f0 = xraylib.Crystal_F_H_StructureFactor(cryst, ener, 0, 0, 0, debyeWaller, 1.0)
+    fH = xraylib.Crystal_F_H_StructureFactor(cryst, ener, hh, kk, ll, debyeWaller, 1.0)
+
+    #
+    # convert structure factor in chi (or psi) = - classical_e_radius wavelength^2 fH /(pi volume)
+    #
+    codata = scipy.constants.physical_constants
+    codata_c,  _, _ = codata["speed of light in vacuum"]
+    codata_h,  _, _ = codata["Planck constant"]
+    codata_ec, _, _ = codata["elementary charge"]
+    codata_r,  _, _ = codata["classical electron radius"]
+
+    ev2meter = codata_h * codata_c / codata_ec
+    wavelength = ev2meter / (ener * 1e3)
+
+    volume = cryst['volume'] * 1e-10 * 1e-10 * 1e-10  # volume of silicon unit cell in m^3
+    cte = - codata_r * wavelength * wavelength / (numpy.pi * volume)
+
+    chi0 = cte * f0
+    chiH = cte * fH
+
+    # this dictionary is shared by all callers: do not modify it
+    return {
+        "cell_dimensions" : (cryst['a'], cryst['b'], cryst['c']),
+        "cell_angles"     : (cryst['alpha'], cryst['beta'], cryst['gamma']),
+        "volume"          : cryst['volume'],
+        "dspacing"        : dspacing,
+        "braggAngle"      : braggAngle,
+        "f0"              : f0,
+        "fH"              : fH,
+        "wavelength"      : wavelength,
+        "chi0"            : chi0,
+        "chiH"            : chiH,
+        }
+
+class LaueScanH5Stream():
+    """
+    Incremental output of x-scans and caustic maps to a h5 file: each block of x values (or of q planes) is appended
+    to chunked, compressed datasets as soon as it is calculated, and flagged as completed. A scan that is interrupted
+    and started again with the same parameters (same signature) only calculates the missing blocks.
+    """
+    def __init__(self, filename, compression="gzip", compression_opts=4, resume=True):
+        self._filename = filename
+        self._compression = compression
+        self._compression_opts = compression_opts
+        self._resume = resume
+        self._name = None
+        self._signature = None
+        self._file = None
+        self._group = None
+        self._blocks = None
+        self._with_error = False
+
+    # name of the h5 group for the next scan, and the parameters that identify it
+    def set_scan(self, name, signature):
+        self._name = name
+        self._signature = signature
+
+    # opens (or resumes) the scan. blocks is the list of slices or index arrays (of x for an x-scan, of q for a
+    # caustic map) calculated together. Returns the number of blocks already completed.
+    def begin(self, blocks, xx, qq=None, with_error=False, block_size=0):
+        signature = self._signature + "\nblock size: %d" % block_size
+        self._file = h5py.File(self._filename, "a")
+        group = self._file.get(self._name)
+        if group is not None:
+            if not self._resume or group.attrs["signature"] != signature or group["completed"].size != len(blocks):
+                del self._file[self._name]
+                group = None
+
+        if group is None:
+            group = self._file.create_group(self._name)
+            group.attrs["signature"] = signature
+            group.attrs["finished"] = False
+            group.create_dataset("x", data=xx)
+            if qq is None:
+                shape, chunks = (xx.size,), (min(xx.size, max(block_size, 1)),)
+            else:
+                group.create_dataset("q", data=qq)
+                shape, chunks = (qq.size, xx.size), (1, xx.size)
+            group.create_dataset("amplitude", shape=shape, dtype=complex, chunks=chunks,
+                                 compression=self._compression, compression_opts=self._compression_opts)
+            if with_error:
+                group.create_dataset("error", shape=shape, dtype=float, chunks=chunks, fillvalue=numpy.nan,
+                                     compression=self._compression, compression_opts=self._compression_opts)
+            group.create_dataset("completed", data=numpy.zeros(len(blocks), dtype=bool))
+            self._file.flush()
+
+        self._group = group
+        self._blocks = blocks
+        self._with_error = with_error
+
+        ncompleted = int(numpy.count_nonzero(group["completed"][()]))
+        if ncompleted > 0:
+            print("Resuming %s from %s: %d of %d blocks already completed" %
+                  (self._name, self._filename, ncompleted, len(blocks)))
+        return ncompleted
+
+    def is_completed(self, i):
+        return bool(self._group["completed"][i])
+
+    def read_block(self, i):
+        index = self._blocks[i]
+        if self._with_error:
+            return numpy.array([self._group["amplitude"][index], self._group["error"][index]])
+        return self._group["amplitude"][index]
+
+    # stores a block as returned by the calculation, and flags it as completed
+    def write_block(self, i, block):
+        self.write(self._blocks[i], block)
+        self._group["completed"][i] = True
+        self._file.flush()
+
+    # stores amplitudes (and errors) that are not tracked as blocks
+    def write(self, index, block):
+        if self._with_error:
+            self._group["amplitude"][index] = block[0]
+            self._group["error"][index] = block[1].real
+        else:
+            self._group["amplitude"][index] = block
+
+    def end(self):
+        self._group.attrs["finished"] = True
+        self.close()
+        print("File %s written to disk" % self._filename)
+
+    # closes the file, e.g. after an interrupted calculation (the completed blocks are kept)
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._group = None
+
+class LaueResultCache():
+    """
+    Persistent cache of the results (numpy arrays) of x-scans, q-scans and caustic maps, one npz file per result in
+    a cache directory, keyed by a hash of the crystal setup (info()) and of the scan parameters. The total size of the
+    directory is limited to max_size bytes: the least recently used results are removed first.
+    """
+    def __init__(self, directory="", max_size=2**30):
+        if directory == "":
+            directory = os.path.join(os.path.expanduser("~"), ".cache", "laue_crystal_focusing")
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_size = max_size
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def key(signature):
+        return hashlib.sha1(signature.encode("utf-8")).hexdigest()
+
+    # the cached arrays (in the order given to put()), or None
+    def get(self, key):
+        filename = self._filename(key)
+        try:
+            with numpy.load(filename) as data:
+                arrays = [data["arr_%d" % i] for i in range(len(data.files))]
+        except FileNotFoundError:
+            self._misses += 1
+            return None
+        except Exception as e: # incomplete or corrupted file
+            print("Removing invalid cache file %s: %s" % (filename, e))
+            self._remove(filename)
+            self._misses += 1
+            return None
+        os.utime(filename) # most recently used
+        self._hits += 1
+        return arrays
+
+    # the file is replaced at once, so a concurrent get() never reads it incomplete
+    def put(self, key, *arrays):
+        filename = self._filename(key)
+        with open(filename + ".tmp", "wb") as f:
+            numpy.savez(f, *arrays)
+        os.replace(filename + ".tmp", filename)
+        self._evict()
+
+    def clear(self):
+        for filename, _, _ in self._entries():
+            self._remove(filename)
+        self._hits = 0
+        self._misses = 0
+
+    # hits, misses, maxsize (bytes), currsize (bytes) and number of entries
+    def cache_info(self):
+        entries = self._entries()
+        return dict(hits=self._hits,
+                    misses=self._misses,
+                    maxsize=self._max_size,
+                    currsize=sum(size for _, _, size in entries),
+                    entries=len(entries))
+
+    def _filename(self, key):
+        return os.path.join(self._directory, key + ".npz")
+
+    # (filename, last use time, size) of the cached results
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # removed by another process
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    # removes the least recently used results until the directory fits in max_size
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        size = sum(entry[2] for entry in entries)
+        for filename, _, file_size in entries:
+            if size <= self._max_size:
+                break
+            self._remove(filename)
+            size -= file_size
+
+    @staticmethod
+    def _remove(filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
 class LaueCrystalFocusing():
     def __init__(self,
                  crystal_descriptor="Si",
@@ -61,7 +660,17 @@ class LaueCrystalFocusing():
                  p=29000.0,  # mm
                  alfa_deg=2.0,  # CAN BE POSITIVE OR NEGATIVE)
                  integration_points=500,
-                 use_fast_hyp1f1=0,
+                 use_fast_hyp1f1=0, # 0=mpmath.hyp1f1, 1=fast_hyp1f1 ("loop" engine) or hyp1f1_array (other engines)
+                 engine="loop", # "loop" (one x and one v at a time), "vectorized" (whole (x, v) grid) or "numba" (compiled)
+                 max_block_size=2**22,  # maximum number of (x, v) samples held in memory by the vectorized engine
+                 kummer_table_tolerance=0.0, # if > 0, interpolate the Kummer function from a table with this relative error
+                 n_workers=1, # number of processes used for x-scans and q-scans
+                 integration_method="trapezoid", # "trapezoid" (integration_points) or "gauss-legendre" (adaptive, vectorized engine)
+                 integration_tolerance=1e-6, # relative tolerance for integration_method="gauss-legendre"
+                 progress_callback=None, # callable(fraction) called at each 10% step of a scan (None: print the progress)
+                 profile=False, # collect per-phase timers (see get_profile() and profile_report())
+                 precision="double", # "double" or "single" ((x, v) arrays in complex64, vectorized engine)
+                 result_cache=None, # LaueResultCache: x-scans, q-scans and caustic maps are read from it if available
                  verbose=1,
                  ):
             self._crystal_descriptor = crystal_descriptor
@@ -74,77 +683,120 @@ class LaueCrystalFocusing():
             self._alfa_deg = alfa_deg  # CAN BE POSITIVE OR NEGATIVE
             self._integration_points = integration_points
             self._use_fast_hyp1f1 = use_fast_hyp1f1
+            self._engine = engine
+            self._max_block_size = max_block_size
+            self._kummer_table_tolerance = kummer_table_tolerance
+            self._kummer_table = None
+            self._n_workers = n_workers
+            self._integration_method = integration_method
+            self._integration_tolerance = integration_tolerance
+            self._precision = precision
+            self._result_cache = result_cache
+            self._error_estimate = None
+            self._precision_deviation = None
+            self._progress_step = -1
+            self._progress_callback = progress_callback
+            self._profile = {} if profile else None
+            self._profile_stack = []
             self._verbose = verbose
 
+            if self._engine not in ("loop", "vectorized", "numba"):
+                raise Exception("Unknown engine: %s (valid values are 'loop', 'vectorized' and 'numba')" % self._engine)
+            if self._engine == "numba" and numba is None:
+                print("numba not available: using engine='vectorized'")
+                self._engine = "vectorized"
+            if self._integration_method not in ("trapezoid", "gauss-legendre"):
+                raise Exception("Unknown integration method: %s (valid values are 'trapezoid' and 'gauss-legendre')" %
+                                self._integration_method)
+            if self._integration_method != "trapezoid" and self._engine != "vectorized":
+                raise Exception("Integration method %s needs engine='vectorized'" % self._integration_method)
+            if self._precision not in ("double", "single"):
+                raise Exception("Unknown precision: %s (valid values are 'double' and 'single')" % self._precision)
+            if self._precision != "double" and self._engine != "vectorized":
+                raise Exception("Precision %s needs engine='vectorized'" % self._precision)
+
     def get_crystal_data(self):
-        import xraylib
-        #
-        # get crystal data for silicon crystal
-        #
-        cryst = xraylib.Crystal_GetCrystal(self._crystal_descriptor)
+        # xraylib lookups are memoized (LRU cache shared by all instances), see crystal_data_cache_info()
+        data = _get_crystal_data(self._crystal_descriptor, tuple(self._hkl), self._photon_energy_in_keV)
 
         # print some info
         if self._verbose:
-            print("  Unit cell dimensions [A] are %f %f %f" % (cryst['a'], cryst['b'], cryst['c']))
-            print("  Unit cell angles are %f %f %f" % (cryst['alpha'], cryst['beta'], cryst['gamma']))
-            print("  Unit cell volume [A] is %f" % (cryst['volume']))
-
-        #
-        # define miller indices and compute dSpacing
-        #
-
-        hh = self._hkl[0]
-        kk = self._hkl[1]
-        ll = self._hkl[2]
-        debyeWaller = 1.0
-        rel_angle = 1.0  # ratio of (incident angle)/(bragg angle) -> we work at Bragg angle
-
-        dspacing = xraylib.Crystal_dSpacing(cryst, hh, kk, ll)
-        if self._verbose: print("dspacing: %f A" % dspacing)
-        #
-        # define energy and get Bragg angle
-        #
-        ener = self._photon_energy_in_keV  # 12.398 # keV
-        braggAngle = xraylib.Bragg_angle(cryst, ener, hh, kk, ll)
-        if self._verbose: print("Bragg angle: %f degrees" % (braggAngle * 180 / numpy.pi))
-
-        #
-        # get the structure factor (at a given energy)
-        #
-        f0 = xraylib.Crystal_F_H_StructureFactor(cryst, ener, 0, 0, 0, debyeWaller, 1.0)
-        fH = xraylib.Crystal_F_H_StructureFactor(cryst, ener, hh, kk, ll, debyeWaller, 1.0)
-        if self._verbose: print("f0: (%f , %f)" % (f0.real, f0.imag))
-        if self._verbose: print("fH: (%f , %f)" % (fH.real, fH.imag))
-
-        #
-        # convert structure factor in chi (or psi) = - classical_e_radius wavelength^2 fH /(pi volume)
-        #
-        codata = scipy.constants.physical_constants
-        codata_c,  _, _ = codata["speed of light in vacuum"]
-        codata_h,  _, _ = codata["Planck constant"]
-        codata_ec, _, _ = codata["elementary charge"]
-        codata_r,  _, _ = codata["classical electron radius"]
-
-        ev2meter = codata_h * codata_c / codata_ec
-        wavelength = ev2meter / (ener * 1e3)
-        if self._verbose: print("Photon energy: %f keV" % ener)
-        if self._verbose: print("Photon wavelength: %f A" % (1e10 * wavelength))
-
-        volume = cryst['volume'] * 1e-10 * 1e-10 * 1e-10  # volume of silicon unit cell in m^3
-        cte = - codata_r * wavelength * wavelength / (numpy.pi * volume)
-
-        chi0 = cte * f0
-        chiH = cte * fH
+            print("  Unit cell dimensions [A] are %f %f %f" % data["cell_dimensions"])
+            print("  Unit cell angles are %f %f %f" % data["cell_angles"])
+            print("  Unit cell volume [A] is %f" % (data["volume"]))
+            print("dspacing: %f A" % data["dspacing"])
+            print("Bragg angle: %f degrees" % (data["braggAngle"] * 180 / numpy.pi))
+            print("f0: (%f , %f)" % (data["f0"].real, data["f0"].imag))
+            print("fH: (%f , %f)" % (data["fH"].real, data["fH"].imag))
+            print("Photon energy: %f keV" % self._photon_energy_in_keV)
+            print("Photon wavelength: %f A" % (1e10 * data["wavelength"]))
+            print("chi0: (%e , %e)" % (data["chi0"].real, data["chi0"].imag))
+            print("chiH: (%e , %e)" % (data["chiH"].real, data["chiH"].imag))
+
+        return data["braggAngle"], numpy.conjugate(data["chi0"]), numpy.conjugate(data["chiH"])
+
+    @classmethod
+    def crystal_data_cache_info(cls):
+        # hits, misses, maxsize and currsize of the crystal data cache
+        return _get_crystal_data.cache_info()
+
+    @classmethod
+    def crystal_data_cache_clear(cls):
+        _get_crystal_data.cache_clear()
+
+    # estimated absolute error of the amplitudes of the last x-scan (None for the loop engine)
+    def get_error_estimate(self):
+        return self._error_estimate
+
+    # precision="single": max |amplitude - double precision amplitude| / max |double precision amplitude| of the last
+    # x-scan or caustic map, from a recalculation in double precision of a subset of the points (None otherwise)
+    def get_precision_deviation(self):
+        return self._precision_deviation
+
+    # per-phase timers: {phase: (time in s, number of calls)} (None if profile=False). With n_workers > 1, the kernel
+    # time is the wall time of the process pool.
+    def get_profile(self):
+        if self._profile is None:
+            return None
+        return {phase: tuple(record) for phase, record in self._profile.items()}
+
+    def reset_profile(self):
+        if self._profile is not None:
+            self._profile.clear()
+
+    def profile_report(self):
+        if self._profile is None:
+            return "Profiling not enabled (use profile=True)"
+        total = sum(record[0] for record in self._profile.values())
+        txt = "%-12s %12s %8s %8s" % ("phase", "time [s]", "calls", "%")
+        for phase in list(PROFILE_PHASES) + sorted(set(self._profile.keys()) - set(PROFILE_PHASES)):
+            if phase in self._profile:
+                seconds, calls = self._profile[phase]
+                txt += "\n%-12s %12.6f %8d %8.1f" % (phase, seconds, calls, 100 * seconds / total if total > 0 else 0)
+        txt += "\n%-12s %12.6f" % ("total", total)
+        return txt
 
-        if self._verbose: print("chi0: (%e , %e)" % (chi0.real, chi0.imag))
-        if self._verbose: print("chiH: (%e , %e)" % (chiH.real, chiH.imag))
+    # hits, misses, size of the result cache (None if result_cache=None)
+    def result_cache_info(self):
+        if self._result_cache is None:
+            return None
+        return self._result_cache.cache_info()
 
-        return braggAngle, numpy.conjugate(chi0), numpy.conjugate(chiH)
+    # the progress callback (e.g. a widget method) is not sent to the process pool
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_progress_callback"] = None
+        return state
 
     #
     # interface for q=0 or finite q
     #
-    def xscan(self, q=1000.0, npoints_x=10, a_factor=1, a_center=0.0, filename=""):
+    # method (finite q only): "direct" integration or "czt" (chirp-z transform, trapezoidal rule on integration_points)
+    # stream: optional LaueScanH5Stream, to write the amplitudes as they are calculated
+    def xscan(self, q=1000.0, npoints_x=10, a_factor=1, a_center=0.0, filename="", method="direct", stream=None):
+
+        if method not in ("direct", "czt"):
+            raise Exception("Unknown method: %s (valid values are 'direct' and 'czt')" % method)
 
         if self._p == 0:
             if q == 0:
@@ -160,24 +812,39 @@ class LaueCrystalFocusing():
         print("Calculating x-scan")
         print("    at p=%.3f mm, q=%.3f..." % (self._p, q))
         print("    using %s" % (txt))
+        if q != 0: print("    with method: %s" % method)
         t0 = time.time()
 
+        key, cached = self._read_result_cache(stream, scan="xscan", q=q, npoints_x=npoints_x, a_factor=a_factor,
+                                              a_center=a_center, method=method)
+        if cached is not None:
+            xx, yy_amplitude, error_estimate = cached
+            self._error_estimate = error_estimate if error_estimate.size > 0 else None
+            self._precision_deviation = None
+            return xx, yy_amplitude, self._create_output_wavefront(xx, yy_amplitude, filename=filename)
+
         if self._p == 0:
             if q == 0:
-                out = self.xscan_at_q0_and_p0(npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, filename=filename)
+                out = self.xscan_at_q0_and_p0(npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, filename=filename,
+                                              stream=stream)
             else:
-                out = self.xscan_at_finite_q_and_p0(q, npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, filename=filename)
+                out = self.xscan_at_finite_q_and_p0(q, npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, filename=filename,
+                                                    method=method, stream=stream)
         else:
             if q == 0:
-                out = self.xscan_at_q0(npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, filename=filename)
+                out = self.xscan_at_q0(npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, filename=filename,
+                                       stream=stream)
             else:
-                out = self.xscan_at_finite_q(q, npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, filename=filename)
+                out = self.xscan_at_finite_q(q, npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, filename=filename,
+                                             method=method, stream=stream)
 
+        self._write_result_cache(key, out[0], out[1],
+                                 numpy.zeros(0) if self._error_estimate is None else self._error_estimate)
         print("Calculation time: ", time.time() - t0)
         return out
 
     # x-scan at p=q=0 using Guigay % Ferrero 2016 eq 23
-    def xscan_at_q0_and_p0(self, npoints_x=10, a_factor=1, a_center=0.0, filename=""):
+    def xscan_at_q0_and_p0(self, npoints_x=10, a_factor=1, a_center=0.0, filename="", stream=None):
 
         kwds = self._calculate_constats_for_equation23_2016()
         a = kwds['a']
@@ -186,30 +853,19 @@ class LaueCrystalFocusing():
         print("a=%.3f mm..." % (a))
 
         xx = numpy.linspace(-a * a_factor, a * a_factor, npoints_x) - a_center
-        yy_amplitude = numpy.zeros_like(xx, dtype=complex)
-
-        print(f"Progress: 0%")
-        for j in range(xx.size):
-            progress = (j + 1) / xx.size * 100
-            if progress % 10 == 0:  print(f"Progress: {progress:.0f}%")
-            amplitude = self._equation23_2016(xx[j], **kwds)
-            yy_amplitude[j] = amplitude
-        print(f"Progress: 100%")
+        if stream is not None:
+            stream.set_scan("xscan_at_q0_and_p0", self._stream_signature(npoints_x=npoints_x, a_factor=a_factor,
+                                                                         a_center=a_center))
+        yy_amplitude = self._evaluate_xscan("_equation23_2016", xx, stream=stream, **kwds)
 
         # create and write wofry wavefront
-        output_wavefront = GenericWavefront1D.initialize_wavefront_from_arrays(
-            1e-3 * xx, yy_amplitude, y_array_pi=None, wavelength=1e-10)
-        output_wavefront.set_photon_energy(1e3 * self._photon_energy_in_keV)
-        if filename != "":
-            output_wavefront.save_h5_file(filename,
-                                          subgroupname="wfr", intensity=True, phase=False, overwrite=True,
-                                          verbose=False)
-            print("File %s written to disk" % filename)
+        output_wavefront = self._create_output_wavefront(xx, yy_amplitude, filename=filename)
 
         return xx, yy_amplitude, output_wavefront
 
     # x-scan at p=0, finite q, using Guigay % Ferrero 2016 eq 24
-    def xscan_at_finite_q_and_p0(self, q=1000.0, npoints_x=10, a_factor=1, a_center=0.0, filename=""):
+    def xscan_at_finite_q_and_p0(self, q=1000.0, npoints_x=10, a_factor=1, a_center=0.0, filename="", method="direct",
+                                 stream=None):
 
         kwds = self._calculate_constats_for_equation23_2016() #?????????????
         a = kwds['a']
@@ -217,31 +873,22 @@ class LaueCrystalFocusing():
         print("a=%.3f mm..." % (a))
 
         xx = numpy.linspace(-a * a_factor, a * a_factor, npoints_x) - a_center
-        yy_amplitude = numpy.zeros_like(xx, dtype=complex)
-
-        print(f"Progress: 0%")
-        for j in range(xx.size):
-            progress = (j + 1) / xx.size * 100
-            if progress % 10 == 0:  print(f"Progress: {progress:.0f}%")
-            amplitude = self._equation24_2016(xx[j], q, **kwds)
-            yy_amplitude[j] = amplitude
-        print(f"Progress: 100%")
+        if stream is not None:
+            stream.set_scan("xscan_at_finite_q_and_p0", self._stream_signature(q=q, npoints_x=npoints_x, a_factor=a_factor,
+                                                                               a_center=a_center, method=method))
+        if method == "czt":
+            yy_amplitude = self._xscan_czt(xx, q, kwds, stream=stream)
+        else:
+            yy_amplitude = self._evaluate_xscan("_equation24_2016", xx, q, stream=stream, **kwds)
 
         # create and write wofry wavefront
-        output_wavefront = GenericWavefront1D.initialize_wavefront_from_arrays(
-            1e-3 * xx, yy_amplitude, y_array_pi=None, wavelength=1e-10)
-        output_wavefront.set_photon_energy(1e3 * self._photon_energy_in_keV)
-        if filename != "":
-            output_wavefront.save_h5_file(filename,
-                                          subgroupname="wfr", intensity=True, phase=False, overwrite=True,
-                                          verbose=False)
-            print("File %s written to disk" % filename)
+        output_wavefront = self._create_output_wavefront(xx, yy_amplitude, filename=filename)
 
         return xx, yy_amplitude, output_wavefront
 
 
     # x-scan at q=0 using Guigay % Ferrero 2016 eq 30
-    def xscan_at_q0(self, npoints_x=10, a_factor=1, a_center=0.0, filename=""):
+    def xscan_at_q0(self, npoints_x=10, a_factor=1, a_center=0.0, filename="", stream=None):
 
         if self._p == 0:
             raise Exception("For p=0 please use xscan_at_q0_and_p0()")
@@ -253,30 +900,19 @@ class LaueCrystalFocusing():
         print("a=%.3f mm..." % (a))
 
         xx = numpy.linspace(-a * a_factor, a * a_factor, npoints_x) - a_center
-        yy_amplitude = numpy.zeros_like(xx, dtype=complex)
-
-        print(f"Progress: 0%")
-        for j in range(xx.size):
-            progress = (j + 1) / xx.size * 100
-            if progress % 10 == 0:  print(f"Progress: {progress:.0f}%")
-            amplitude = self._equation30_2016(xx[j], **kwds)
-            yy_amplitude[j] = amplitude
-        print(f"Progress: 100%")
+        if stream is not None:
+            stream.set_scan("xscan_at_q0", self._stream_signature(npoints_x=npoints_x, a_factor=a_factor,
+                                                                  a_center=a_center))
+        yy_amplitude = self._evaluate_xscan("_equation30_2016", xx, stream=stream, **kwds)
 
         # create and write wofry wavefront
-        output_wavefront = GenericWavefront1D.initialize_wavefront_from_arrays(
-            1e-3 * xx, yy_amplitude, y_array_pi=None, wavelength=1e-10)
-        output_wavefront.set_photon_energy(1e3 * self._photon_energy_in_keV)
-        if filename != "":
-            output_wavefront.save_h5_file(filename,
-                                          subgroupname="wfr", intensity=True, phase=False, overwrite=True,
-                                          verbose=False)
-            print("File %s written to disk" % filename)
+        output_wavefront = self._create_output_wavefront(xx, yy_amplitude, filename=filename)
 
         return xx, yy_amplitude, output_wavefront
 
     # x-scan at finite q using Guigay % Ferrero 2016 eq 31
-    def xscan_at_finite_q(self, q=1000.0, npoints_x=10, a_factor=1, a_center=0.0, filename=""):
+    def xscan_at_finite_q(self, q=1000.0, npoints_x=10, a_factor=1, a_center=0.0, filename="", method="direct",
+                          stream=None):
 
         if self._p == 0:
             raise Exception("For p=0 please use xscan_at_finite_q_and_p0()")
@@ -288,31 +924,24 @@ class LaueCrystalFocusing():
         print("a=%.3f mm..." % (a))
 
         xx = numpy.linspace(-a * a_factor, a * a_factor, npoints_x) - a_center
-        yy_amplitude = numpy.zeros_like(xx, dtype=complex)
-
-        print(f"Progress: 0%")
-        for j in range(xx.size):
-            progress = (j + 1) / xx.size * 100
-            if progress % 10 == 0:  print(f"Progress: {progress:.0f}%")
-            amplitude = self._equation31_2016(xx[j], q, **kwds)
-            yy_amplitude[j] = amplitude
-        print(f"Progress: 100%")
+        if stream is not None:
+            stream.set_scan("xscan_at_finite_q", self._stream_signature(q=q, npoints_x=npoints_x, a_factor=a_factor,
+                                                                        a_center=a_center, method=method))
+        if method == "czt":
+            yy_amplitude = self._xscan_czt(xx, q, kwds, stream=stream)
+        else:
+            yy_amplitude = self._evaluate_xscan("_equation31_2016", xx, q, stream=stream, **kwds)
 
         # create and write wofry wavefront
-        output_wavefront = GenericWavefront1D.initialize_wavefront_from_arrays(
-            1e-3 * xx, yy_amplitude, y_array_pi=None, wavelength=1e-10)
-        output_wavefront.set_photon_energy(1e3 * self._photon_energy_in_keV)
-        if filename != "":
-            output_wavefront.save_h5_file(filename,
-                                          subgroupname="wfr", intensity=True, phase=False, overwrite=True,
-                                          verbose=False)
-            print("File %s written to disk" % filename)
+        output_wavefront = self._create_output_wavefront(xx, yy_amplitude, filename=filename)
 
         return xx, yy_amplitude, output_wavefront
 
 ####################################
     # x-scan at p=q=0 using Guigay % Ferrero 2016 eq 23
-    def xscan_for_external_wavefront(self, Phi=None, Phi_tau=None, npoints_x=10, a_factor=1, a_center=0.0, filename=""):
+    # Phi: complex amplitude of the incident wavefront at the abscissas Phi_tau (mm), or a wofry GenericWavefront1D
+    def xscan_for_external_wavefront(self, Phi=None, Phi_tau=None, npoints_x=10, a_factor=1, a_center=0.0, filename="",
+                                     stream=None):
 
         ##################################
         # from srxraylib.plot.gol import plot
@@ -327,42 +956,92 @@ class LaueCrystalFocusing():
         print("a=%.3f mm..." % (a))
 
         xx = numpy.linspace(-a * a_factor, a * a_factor, npoints_x) - a_center
-        yy_amplitude = numpy.zeros_like(xx, dtype=complex)
 
         ##
+        if isinstance(Phi, GenericWavefront1D):
+            Phi_tau = 1e3 * Phi.get_abscissas() # m -> mm
+            Phi = Phi.get_complex_amplitude()
         if Phi is None: Phi = numpy.ones_like(xx, dtype=complex)
         if Phi_tau is None: Phi_tau = xx
         ##
 
 
-        # interpolator
-        f_mag = interpolate.interp1d(Phi_tau, numpy.abs(Phi), kind='linear', bounds_error=False, fill_value=0)
-        f_phase = interpolate.interp1d(Phi_tau, numpy.angle(Phi), kind='linear', bounds_error=False, fill_value=0)
+        # interpolator of the complex amplitude (real and imaginary parts, so no phase wrapping), evaluated on the
+        # whole (x, tau) grid of a block at once by the vectorized engines
+        f_phi = interpolate.interp1d(Phi_tau, numpy.asarray(Phi, dtype=complex), kind='linear', bounds_error=False,
+                                     fill_value=0)
 
-        print(f"Progress: 0%")
-        for j in range(xx.size):
-            progress = (j + 1) / xx.size * 100
-            if progress % 10 == 0:  print(f"Progress: {progress:.0f}%")
-            # amplitude = self._equation28_2016(xx[j], Phi, Phi_tau, **kwds)
-            amplitude = self._equation28_2016(xx[j], f_mag, f_phase, **kwds)
-            yy_amplitude[j] = amplitude
-        print(f"Progress: 100%")
+        if stream is not None:
+            phi_hash = hashlib.sha1(numpy.ascontiguousarray(Phi, dtype=complex).tobytes() +
+                                    numpy.ascontiguousarray(Phi_tau, dtype=float).tobytes()).hexdigest()
+            stream.set_scan("xscan_for_external_wavefront", self._stream_signature(Phi=phi_hash, npoints_x=npoints_x,
+                                                                                   a_factor=a_factor, a_center=a_center))
+        yy_amplitude = self._evaluate_xscan("_equation28_2016", xx, f_phi, stream=stream, **kwds)
 
         # create and write wofry wavefront
+        output_wavefront = self._create_output_wavefront(xx, yy_amplitude, filename=filename)
+
+        return xx, yy_amplitude, output_wavefront
+####################################
+    #
+    # private methods
+    #
+
+    # identifies a scan written to a LaueScanH5Stream: the parameters that determine the result (as in the result
+    # cache) and the scan parameters. The block layout is added by LaueScanH5Stream.begin().
+    def _stream_signature(self, **parameters):
+        return self._result_signature(**parameters)
+
+    # identifies a result in the result cache: the parameters that determine the result, i.e. not n_workers,
+    # max_block_size, profile, verbose...
+    def _result_signature(self, **parameters):
+        parameters = dict(parameters,
+                          crystal_descriptor=self._crystal_descriptor,
+                          hkl=list(self._hkl),
+                          R=self._R,
+                          poisson_ratio=self._poisson_ratio,
+                          photon_energy_in_keV=self._photon_energy_in_keV,
+                          thickness=self._thickness,
+                          p=self._p,
+                          alfa_deg=self._alfa_deg,
+                          integration_points=self._integration_points,
+                          use_fast_hyp1f1=self._use_fast_hyp1f1,
+                          engine=self._engine,
+                          kummer_table_tolerance=self._kummer_table_tolerance,
+                          integration_method=self._integration_method,
+                          integration_tolerance=self._integration_tolerance,
+                          precision=self._precision)
+        return "".join("\n%s: %r" % (key, parameters[key]) for key in sorted(parameters))
+
+    # key and arrays of a result in the result cache (arrays=None if not cached). A scan written to a stream is
+    # always calculated (key=None).
+    def _read_result_cache(self, stream=None, **parameters):
+        if self._result_cache is None or stream is not None:
+            return None, None
+        key = self._result_cache.key(self._result_signature(**parameters))
+        with self._timer("io"):
+            arrays = self._result_cache.get(key)
+        if arrays is not None:
+            print("    read from the result cache (%s)" % key)
+        return key, arrays
+
+    def _write_result_cache(self, key, *arrays):
+        if key is not None:
+            with self._timer("io"):
+                self._result_cache.put(key, *arrays)
+
+    # wofry wavefront (x in m) for a scan, written to an h5 file if filename is given
+    @_timed("io")
+    def _create_output_wavefront(self, xx, yy_amplitude, filename="", subgroupname="wfr", overwrite=True):
         output_wavefront = GenericWavefront1D.initialize_wavefront_from_arrays(
             1e-3 * xx, yy_amplitude, y_array_pi=None, wavelength=1e-10)
         output_wavefront.set_photon_energy(1e3 * self._photon_energy_in_keV)
         if filename != "":
             output_wavefront.save_h5_file(filename,
-                                          subgroupname="wfr", intensity=True, phase=False, overwrite=True,
+                                          subgroupname=subgroupname, intensity=True, phase=False, overwrite=overwrite,
                                           verbose=False)
             print("File %s written to disk" % filename)
-
-        return xx, yy_amplitude, output_wavefront
-####################################
-    #
-    # private methods
-    #
+        return output_wavefront
 
     # Guigay&Ferrero 2016: calculate equation 23, p=q=0
     def _equation23_2016(self, x,
@@ -397,10 +1076,7 @@ class LaueCrystalFocusing():
             Z = k * numpy.sqrt(chih2) / numpy.sin(2 * teta)
             kum = BesselJ(0, Z * numpy.sqrt(a ** 2 - x ** 2))
         else:
-            if self._use_fast_hyp1f1:
-                kum = fast_hyp1f1(kap, acmax * (1 - (x / a) ** 2))
-            else:
-                kum = mpmath.hyp1f1(1j * kap, 1, 1j * acmax * (1 - (x / a) ** 2))
+            kum = self._kummer(kap, acmax * (1 - (x / a) ** 2))
 
         return numpy.exp((1j * k * chizero.real - k * chizero.imag) * 0.25 * (t1 + t2)) * \
                kum * \
@@ -450,10 +1126,7 @@ class LaueCrystalFocusing():
                 Z = k * numpy.sqrt(chih2) / numpy.sin(2 * teta)
                 kum = BesselJ(0, Z * numpy.sqrt(a ** 2 - v[i] ** 2))
             else:
-                if self._use_fast_hyp1f1:
-                    kum = fast_hyp1f1(kap, acmax * (1 - (v[i] / a) ** 2))
-                else:
-                    kum = mpmath.hyp1f1(1j * kap, 1, 1j * acmax * (1 - (v[i] / a) ** 2))
+                kum = self._kummer(kap, acmax * (1 - (v[i] / a) ** 2))
 
             Q1 = 1j * k * 0.5 * v[i] ** 2 * invle
             Q2 = k * v[i] * (x / q - 1j * kiny)
@@ -462,13 +1135,13 @@ class LaueCrystalFocusing():
                    numpy.exp(Q1) * \
                    numpy.cos(Q2)
 
-        return 2 * numpy.trapz(y, x=v) * numpy.sqrt(att / numpy.abs(lambda1 * q))
+        return 2 * trapezoid(y, x=v) * numpy.sqrt(att / numpy.abs(lambda1 * q))
 
 ########################################
     # Guigay&Ferrero 2016: calculate integral in equation 28 for q=0 with a given wavefront amplitude defined at p=0
     # note that the integral limits are gamma (u+-a) and the integrand is Phi(tau) P(u,tau) with Phi() the complex amplitude
     def _equation28_2016(self, x,
-                        f_mag, f_phase, # interpolator
+                        f_phi, # interpolator of the complex amplitude
                         a       = None,
                         mu1     = None,
                         mu2     = None,
@@ -495,6 +1168,7 @@ class LaueCrystalFocusing():
                       ):
 
         tau = numpy.linspace(gamma * (x - a), gamma * (x + a), self._integration_points)
+        A = f_phi(tau)
         y = numpy.zeros_like(tau, dtype=complex)
 
         for i in range(tau.size):
@@ -508,19 +1182,15 @@ class LaueCrystalFocusing():
                 if arg1 < 0: arg1 = 0
                 kum = BesselJ(0, Z * numpy.sqrt(arg1))
             else:
-                if self._use_fast_hyp1f1:
-                    kum = fast_hyp1f1(kap, yprime)
-                else:
-                    kum = mpmath.hyp1f1(1j * kap, 1, 1j * yprime)
+                kum = self._kummer(kap, yprime)
 
             Q1 = 1j * k * nu * omega
             Q2 = -1j * k * (mu1 * x**2 + x * t1 * numpy.sin(teta1)) / (2 * self._R)
             Q3 = -1j * k * (mu2 * (nu - x)**2 - a2 * gamma * (nu - x)) / (2 * self._R)
             Q4 = 1j * k * (g / self._R) * (a + x) * (nu - x)
-            A = f_mag(tau[i]) * numpy.exp(1j * f_phase(tau[i]))
-            y[i] = A * kum * numpy.exp(Q1 + Q2 + Q3 + Q4)
+            y[i] = A[i] * kum * numpy.exp(Q1 + Q2 + Q3 + Q4)
 
-        amplitude = numpy.trapz(y, x=tau)
+        amplitude = trapezoid(y, x=tau)
         return amplitude
 
 ########################################
@@ -572,14 +1242,11 @@ class LaueCrystalFocusing():
                 Z = k * numpy.sqrt(chih2) / numpy.sin(2 * teta)
                 kum = BesselJ(0, Z * numpy.sqrt(a ** 2 - v[i] ** 2))
             else:
-                if self._use_fast_hyp1f1:
-                    kum = fast_hyp1f1(kap, yprime)
-                else:
-                    kum = mpmath.hyp1f1(1j * kap, 1, 1j * yprime)
+                kum = self._kummer(kap, yprime)
 
             y[i] = mfac * kum * numpy.exp(1j * k * Q)
 
-        return numpy.trapz(y, x=v)
+        return trapezoid(y, x=v)
 
     # Guigay&Ferrero 2016: calculate integral in equation 31 and add the corresponding phases, finite p, finite q
     # note that the x argument here is in fact (x - xc) in eq. 31
@@ -622,17 +1289,14 @@ class LaueCrystalFocusing():
                 Z = k * numpy.sqrt(chih2) / numpy.sin(2 * teta)
                 kum = BesselJ(0, Z * numpy.sqrt(a ** 2 - v[i] ** 2))
             else:
-                if self._use_fast_hyp1f1:
-                    kum = fast_hyp1f1(kap, yprime)
-                else:
-                    kum = mpmath.hyp1f1(1j * kap, 1, 1j * yprime)
+                kum = self._kummer(kap, yprime)
 
             Q1 = 1j * k * 0.5 * v[i] ** 2 * invle
             Q2 = - k * v[i] * kiny
             Q3 = k * v[i] * x / (q * pe * be)
             y[i] = kum * numpy.exp(Q1 + Q2) * numpy.cos(Q3)
 
-        amplitude = numpy.trapz(y, x=v)
+        amplitude = trapezoid(y, x=v)
 
         amplitude *= numpy.sqrt(att / (lambda1 * q * self._p * be))
         # omitted phase (see just after equation 30)
@@ -645,11 +1309,587 @@ class LaueCrystalFocusing():
                                (x / q + t1 * numpy.sin(teta1) / 2 / self._R + m) ** 2)
         return amplitude
 
+    #
+    # vectorized engine: the same equations evaluated for an array of x values at once. The integrand is built
+    # as a 2D array (x along axis 0, integration variable along axis 1) and integrated along axis 1.
+    #
+
+    # x-scan at finite q (eq 31, or eq 24 if p=0) with chirp-z transforms: O(N log N) in the number of x and v points
+    @_timed("kernel")
+    def _xscan_czt(self, xx, q, kwds, stream=None):
+        if stream is not None:
+            with self._timer("io"):
+                stream.begin([slice(0, xx.size)], xx, with_error=True, block_size=xx.size)
+        try:
+            if stream is not None and stream.is_completed(0):
+                with self._timer("io"):
+                    amplitude, error = stream.read_block(0)
+                self._error_estimate = error.real
+            else:
+                qq = numpy.array([q], dtype=float)
+                v, factor = self._caustic_factors(**kwds)
+                amplitude = self._caustic_block(qq, xx, v, factor, kwds, method="czt")[0]
+
+                # Richardson error estimate, from the trapezoidal rule on every other point
+                weights = _coarse_trapezoid_weights(v) / _trapezoid_weights(v)
+                amplitude_coarse = self._caustic_block(qq, xx, v, factor * weights, kwds, method="czt")[0]
+                self._error_estimate = numpy.abs(amplitude - amplitude_coarse) / 3
+
+                if stream is not None:
+                    with self._timer("io"):
+                        stream.write_block(0, numpy.array([amplitude, self._error_estimate]))
+            if stream is not None:
+                with self._timer("io"):
+                    stream.end()
+        finally:
+            if stream is not None:
+                stream.close()
+        return amplitude
+
+    # amplitudes for all xx using self.<equation>() one x at a time ("loop" engine) or self.<equation>_array()
+    # (self.<equation>_numba() if available for the "numba" engine) on blocks of x values. The blocks are distributed
+    # over a process pool if n_workers > 1.
+    def _evaluate_xscan(self, equation, xx, *args, stream=None, **kwds):
+        array_kernels = self._use_array_kernels(kwds["alfa"])
+        if array_kernels:
+            method_name = "_evaluate_array_block"
+            # the (x, v) integrand never exceeds self._max_block_size samples
+            chunk_size = max(1, self._max_block_size // self._integration_points)
+        else:
+            method_name = "_evaluate_scalar_block"
+            chunk_size = 1 if self._n_workers <= 1 and stream is None else xx.size
+
+        if stream is not None: # same blocks for any n_workers
+            chunk_size = min(chunk_size, int(numpy.ceil(xx.size / _STREAM_BLOCKS)))
+        elif self._n_workers > 1: # about 4 chunks per worker, for load balancing
+            chunk_size = min(chunk_size, int(numpy.ceil(xx.size / (4 * self._n_workers))))
+
+        chunks = [xx[i:i + chunk_size] for i in range(0, xx.size, chunk_size)]
+        if stream is not None:
+            with self._timer("io"):
+                stream.begin([slice(i, i + chunk_size) for i in range(0, xx.size, chunk_size)], xx,
+                             with_error=array_kernels, block_size=chunk_size)
+        try:
+            results = numpy.concatenate(self._map_chunks(method_name, chunks, equation, *args, stream=stream, **kwds),
+                                        axis=-1)
+            if stream is not None:
+                with self._timer("io"):
+                    stream.end()
+        finally:
+            if stream is not None:
+                stream.close()
+
+        if array_kernels:
+            self._error_estimate = results[1].real
+            if self._precision != "double":
+                self._check_precision(results[0], xx, "_evaluate_array_block", equation, *args, **kwds)
+            return results[0]
+        else:
+            self._error_estimate = None
+            return results
+
+    # compares the single precision amplitudes (last axis: xx) with a recalculation in double precision on at most
+    # npoints x values (and on the first rows of a caustic map): sets and prints self._precision_deviation
+    def _check_precision(self, amplitude, xx, method_name, *args, npoints=16, **kwds):
+        step = max(1, int(numpy.ceil(xx.size / npoints)))
+        laue = copy.copy(self)
+        laue._precision = "double"
+        reference = numpy.array(getattr(laue, method_name)(xx[::step], *args, **kwds))
+        if method_name == "_evaluate_array_block":
+            reference = reference[0]
+        amplitude = amplitude[..., ::step]
+        scale = numpy.abs(reference).max()
+        self._precision_deviation = numpy.abs(amplitude - reference).max() / scale if scale > 0 else 0.0
+        print("Single precision: max relative deviation from double precision %.2e (%d points)" %
+              (self._precision_deviation, reference.size))
+
+    # the scalar kernels are only used by the "loop" engine, and never for a symmetric Laue crystal (alfa=0), for
+    # which the vectorized J0 replaces the Kummer function
+    def _use_array_kernels(self, alfa):
+        return self._engine != "loop" or alfa == 0
+
+    @_timed("kernel")
+    def _evaluate_array_block(self, xx, equation, *args, **kwds):
+        if self._engine == "numba" and hasattr(self, equation + "_numba"):
+            method = getattr(self, equation + "_numba")
+        else:
+            method = getattr(self, equation + "_array")
+        return numpy.array(method(xx, *args, return_error=True, **kwds))
+
+    @_timed("kernel")
+    def _evaluate_scalar_block(self, xx, equation, *args, **kwds):
+        yy_amplitude = numpy.zeros_like(xx, dtype=complex)
+        for j in range(xx.size):
+            yy_amplitude[j] = getattr(self, equation)(xx[j], *args, **kwds)
+        return yy_amplitude
+
+    # calls self.<method_name>(chunk, *args, **kwds) for each chunk, serially or in a process pool (n_workers > 1).
+    # The results are returned in the order of chunks, and the progress is reported as the chunks are completed.
+    # With a (begun) stream, each result is written as soon as it is available, and the chunks already completed
+    # in the stream are read instead of calculated.
+    def _map_chunks(self, method_name, chunks, *args, stream=None, **kwds):
+        nchunks = len(chunks)
+        results = [None] * nchunks
+        todo = []
+        for i in range(nchunks):
+            if stream is not None and stream.is_completed(i):
+                with self._timer("io"):
+                    results[i] = stream.read_block(i)
+            else:
+                todo.append(i)
+
+        ndone = nchunks - len(todo)
+        self._report_progress(0.0)
+        if ndone > 0:
+            self._report_progress(ndone / nchunks)
+        if self._n_workers > 1 and len(todo) > 1:
+            with self._timer("kernel"), \
+                 concurrent.futures.ProcessPoolExecutor(max_workers=min(self._n_workers, len(todo)),
+                                                      mp_context=_POOL_CONTEXT) as executor:
+                futures = {executor.submit(_call_method, self, method_name, chunks[i], *args, **kwds): i for i in todo}
+                for future in concurrent.futures.as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    if stream is not None:
+                        with self._timer("io"):
+                            stream.write_block(i, results[i])
+                    ndone += 1
+                    self._report_progress(ndone / nchunks)
+        else:
+            for i in todo:
+                results[i] = getattr(self, method_name)(chunks[i], *args, **kwds)
+                if stream is not None:
+                    with self._timer("io"):
+                        stream.write_block(i, results[i])
+                ndone += 1
+                self._report_progress(ndone / nchunks)
+        return results
+
+    # reports the progress (callback or print) each time a new 10% step is reached (fraction=0 starts a new
+    # calculation). Called once per chunk, never in the inner loops.
+    def _report_progress(self, fraction):
+        step = int(10 * fraction + 1e-9)
+        if fraction == 0.0:
+            self._progress_step = -1
+        if step > self._progress_step:
+            self._progress_step = step
+            if self._progress_callback is None:
+                print(f"Progress: {10 * step}%")
+            else:
+                self._progress_callback(step / 10)
+
+    # context manager timing a phase (a shared no-op if profile=False)
+    def _timer(self, phase):
+        if self._profile is None:
+            return _NULL_TIMER
+        return _PhaseTimer(self._profile, self._profile_stack, phase)
+
+    #
+    # Kummer function hyp1f1(1j*kap, 1, 1j*yprime)
+    #
+
+    # (re)build the Kummer table if needed. Called by the constants builders, so the table follows any change
+    # of the crystal parameters (kap) or of the crystal thickness (range of yprime).
+    def _prepare_kummer_table(self, kap, acmax):
+        if self._kummer_table_tolerance <= 0:
+            self._kummer_table = None
+            return
+
+        pad = 1e-6 * numpy.abs(acmax)
+        ymin = min(0.0, acmax) - pad
+        ymax = max(0.0, acmax) + pad
+        if self._kummer_table is None or \
+                not self._kummer_table.is_valid_for(kap, ymin, ymax, self._kummer_table_tolerance):
+            self._kummer_table = KummerTable(kap, ymin, ymax, tolerance=self._kummer_table_tolerance,
+                                             function=self._kummer_array_direct)
+            if self._verbose: print(self._kummer_table.info())
+
+    def _kummer_table_for(self, kap):
+        if self._kummer_table is not None and self._kummer_table._kap == kap:
+            return self._kummer_table
+        return None
+
+    # scalar evaluation, used by the "loop" engine
+    def _kummer(self, kap, yprime):
+        table = self._kummer_table_for(kap)
+        if table is not None and table.contains(yprime):
+            return complex(table(yprime))
+
+        if self._use_fast_hyp1f1:
+            return fast_hyp1f1(kap, yprime)
+        else:
+            return mpmath.hyp1f1(1j * kap, 1, 1j * yprime)
+
+    # array evaluation, used by the "vectorized" engine
+    def _kummer_array(self, kap, yprime):
+        table = self._kummer_table_for(kap)
+        if table is None:
+            return self._kummer_array_direct(kap, yprime)
+
+        yprime = numpy.asarray(yprime, dtype=float)
+        inside = table.contains(yprime)
+        kum = numpy.zeros(yprime.shape, dtype=complex)
+        kum[inside] = table(yprime[inside])
+        if not numpy.all(inside):
+            kum[~inside] = self._kummer_array_direct(kap, yprime[~inside])
+        return kum
+
+    def _kummer_array_direct(self, kap, yprime):
+        if self._use_fast_hyp1f1:
+            return hyp1f1_array(kap, yprime)
+
+        yprime = numpy.asarray(yprime, dtype=float)
+        kum = numpy.zeros(yprime.shape, dtype=complex)
+        kum_flat = kum.reshape(-1)
+        for i, yp in enumerate(yprime.reshape(-1)):
+            kum_flat[i] = complex(mpmath.hyp1f1(1j * kap, 1, 1j * yp))
+        return kum
+
+    def _bessel_array(self, v, a=None, teta=None, k=None, chih2=None):
+        # J0(Z sqrt(a^2 - v^2)), the alfa=0 limit of the Kummer function
+        Z = k * numpy.sqrt(chih2) / numpy.sin(2 * teta)
+        return BesselJ(0, Z * numpy.sqrt(numpy.maximum(a ** 2 - v ** 2, 0)))
+
+    # Guigay&Ferrero 2016: equation 23 for an array of x values
+    def _equation23_2016_array(self, xx,
+                               a=None, mu1=None, teta=None, teta1=None, alfa=None, omega=None, t1=None,
+                               kap=None, k=None, acmax=None, chizero=None, t2=None, chih2=None,
+                               return_error=False, **kwds):
+
+        inside = numpy.abs(xx) <= a
+        x = xx[inside]
+
+        if alfa == 0:
+            kum = self._bessel_array(x, a=a, teta=teta, k=k, chih2=chih2)
+        else:
+            kum = self._kummer_array(kap, acmax * (1 - (x / a) ** 2))
+
+        amplitude = numpy.zeros_like(xx, dtype=complex)
+        amplitude[inside] = numpy.exp((1j * k * chizero.real - k * chizero.imag) * 0.25 * (t1 + t2)) * \
+               kum * \
+               numpy.exp(-1j * x ** 2 * k * mu1 / 2 / self._R) * \
+               numpy.exp(1j * x * k * (omega.real - t1 * numpy.sin(teta1) / 2 / self._R)) * \
+               numpy.exp(- x * k * omega.imag)
+
+        if return_error: # no integral here
+            return amplitude, numpy.zeros_like(xx)
+        return amplitude
+
+    # Guigay&Ferrero 2016: equation 24 for an array of x values
+    def _equation24_2016_array(self, xx, q,
+                               a=None, mu1=None, teta=None, alfa=None, lambda1=None,
+                               kap=None, k=None, acmax=None, kiny=None, att=None, chih2=None,
+                               return_error=False, **kwds):
+
+        invle = 1 / q - mu1 / self._R
+
+        def integrand(xx, v):
+            if alfa == 0:
+                kum = self._bessel_array(v, a=a, teta=teta, k=k, chih2=chih2)
+            else:
+                kum = self._kummer_array(kap, acmax * (1 - (v / a) ** 2))
+
+            Q1 = 1j * k * 0.5 * v ** 2 * invle
+            if self._precision == "double":
+                Q2 = k * numpy.outer(xx / q - 1j * kiny, v)
+                return (kum * numpy.exp(Q1))[numpy.newaxis, :] * numpy.cos(Q2)
+            # cos(Q2) with the phase k x v / q and the damping k kiny v
+            return self._working_precision(kum * numpy.exp(Q1))[numpy.newaxis, :] * \
+                   self._cos(k * numpy.outer(xx / q, v), k * kiny * v)
+
+        integral, error = self._integrate(integrand, xx, 0, a)
+
+        factor = 2 * numpy.sqrt(att / numpy.abs(lambda1 * q))
+        if return_error:
+            return integral * factor, error * numpy.abs(factor)
+        return integral * factor
+
+    # Guigay&Ferrero 2016: integral in equation 28 for an array of x values
+    # (integrated over nu = x - tau / gamma, that runs from a to -a for every x)
+    def _equation28_2016_array(self, xx,
+                               f_phi, # interpolator of the complex amplitude
+                               a=None, mu1=None, mu2=None, teta=None, teta1=None, alfa=None, gamma=None,
+                               omega=None, t1=None, a2=None, g=None, kap=None, k=None, acmax=None, chih2=None,
+                               return_error=False, **kwds):
+
+        def integrand(xx, nu):
+            if alfa == 0:
+                kum = self._bessel_array(nu, a=a, teta=teta, k=k, chih2=chih2)
+            else:
+                kum = self._kummer_array(kap, acmax * (1 - (nu / a) ** 2))
+
+            x = xx[:, numpy.newaxis]
+            tau = gamma * (x - nu[numpy.newaxis, :])
+            Q1 = 1j * k * nu * omega
+            Q2 = -1j * k * (mu1 * x**2 + x * t1 * numpy.sin(teta1)) / (2 * self._R)
+            Q3 = -1j * k * (mu2 * (nu - x)**2 - a2 * gamma * (nu - x)) / (2 * self._R)
+            Q4 = 1j * k * (g / self._R) * (a + x) * (nu - x)
+            return f_phi(tau) * kum[numpy.newaxis, :] * numpy.exp(Q1 + Q2 + Q3 + Q4)
+
+        integral, error = self._integrate(integrand, xx, -a, a)
+
+        if return_error:
+            return gamma * integral, gamma * error
+        return gamma * integral
+
+    # Guigay&Ferrero 2016: integral with limits -a,a in equation 30 for an array of x values
+    def _equation30_2016_array(self, xx,
+                               a=None, mu1=None, mu2=None, teta=None, teta1=None, alfa=None, acrist=None,
+                               gamma=None, lambda1=None, omega=None, t1=None, a2=None, g=None, kap=None, k=None,
+                               chih2=None, return_error=False, **kwds):
+
+        mfac = gamma / numpy.sqrt(lambda1 * self._p)
+        pe = 1 / (1 / self._p - mu2 / self._R)
+
+        def integrand(xx, v):
+            x = xx[:, numpy.newaxis]
+
+            yprime = acrist * gamma * numpy.maximum(a ** 2 - v ** 2, 0) / (numpy.sin(2 * teta)) ** 2  # defined before eq 29
+
+            Q1 = gamma**2 * (x - v)**2 / (2 * pe)  # quadratic
+            Q2 = -(mu1 * x**2) / (2 * self._R)
+            Q3 = -(x * t1 * numpy.sin(teta1) - a2 * gamma * (v - x)) / (2 * self._R)
+            Q4 = v * omega + g * (a + x) * (v - x) / self._R
+
+            if alfa == 0:
+                kum = self._bessel_array(v, a=a, teta=teta, k=k, chih2=chih2)
+            else:
+                kum = self._kummer_array(kap, yprime)
+
+            if self._precision == "double":
+                return mfac * kum[numpy.newaxis, :] * numpy.exp(1j * k * (Q1 + Q2 + Q3 + Q4))
+            # omega is the only complex term of the phase: its imaginary part is a damping along v
+            Q4 = v * omega.real + g * (a + x) * (v - x) / self._R
+            return self._working_precision(mfac * kum * numpy.exp(-k * v * omega.imag))[numpy.newaxis, :] * \
+                   self._cis(k * (Q1 + Q2 + Q3 + Q4))
+
+        integral, error = self._integrate(integrand, xx, -a, a)
+
+        if return_error:
+            return integral, error
+        return integral
+
+    # Guigay&Ferrero 2016: equation 31 (integral and phases) for an array of x values
+    def _equation31_2016_array(self, xx, q,
+                               a=None, mu1=None, teta=None, teta1=None, alfa=None, gamma=None, lambda1=None,
+                               t1=None, g=None, kap=None, k=None, pe=None, acmax=None, kiny=None, att=None,
+                               chizero=None, t2=None, chih2=None, return_error=False, **kwds):
+
+        qe = q * self._R / (self._R - q * mu1 - g * q)
+        be = 1 / qe + 1 / pe
+        invle = 1 / (pe + qe) + g / self._R
+
+        def integrand(xx, v):
+            if alfa == 0:
+                kum = self._bessel_array(v, a=a, teta=teta, k=k, chih2=chih2)
+            else:
+                kum = self._kummer_array(kap, acmax * (1 - (v / a) ** 2))
+
+            Q1 = 1j * k * 0.5 * v ** 2 * invle
+            Q2 = - k * v * kiny
+            Q3 = k * numpy.outer(xx, v) / (q * pe * be)
+            return self._working_precision(kum * numpy.exp(Q1 + Q2))[numpy.newaxis, :] * self._cos(Q3)
+
+        amplitude, error = self._integrate(integrand, xx, -a, a)
+
+        factor = self._equation31_2016_factor(xx, q, be, a=a, teta1=teta1, gamma=gamma, lambda1=lambda1, t1=t1, g=g,
+                                              k=k, att=att, chizero=chizero, t2=t2)
+        amplitude *= factor
+
+        if return_error:
+            return amplitude, error * numpy.abs(factor)
+        return amplitude
+
+    # Guigay&Ferrero 2016: factor and phases of equation 31 outside the integral
+    def _equation31_2016_factor(self, xx, q, be, a=None, teta1=None, gamma=None, lambda1=None, t1=None, g=None,
+                                k=None, att=None, chizero=None, t2=None, **kwds):
+        s = 0
+        factor = numpy.sqrt(att / (lambda1 * q * self._p * be))
+        # omitted phase (see just after equation 30)
+        factor = factor * numpy.exp(1j * k * xx ** 2 / 2 / q) * \
+                     numpy.exp(1j * k * s ** 2 / 2 / self._p) * \
+                     numpy.exp(1j * k * chizero.real * (t1 + t2) / 4)
+        # omitted phase (see just before equation 31)
+        m = g * a / self._R + gamma * (s / self._p + a ** 2 / 2 / self._R)  ## CHECK, shown after eq 30
+        factor = factor * numpy.exp(- 1j * (k / 2 / be) * \
+                               (xx / q + t1 * numpy.sin(teta1) / 2 / self._R + m) ** 2)
+        return factor
+
+    #
+    # "numba" engine: the sums over v of the trapezoidal rule are compiled (the v profiles, e.g. the Kummer function,
+    # and the factors outside the integrals are calculated with numpy). Same arguments and results as *_array().
+    #
+    def _equation24_2016_numba(self, xx, q,
+                               a=None, mu1=None, teta=None, alfa=None, lambda1=None,
+                               kap=None, k=None, acmax=None, kiny=None, att=None, chih2=None,
+                               return_error=False, **kwds):
+
+        v = numpy.linspace(0, a, self._integration_points)
+        if alfa == 0:
+            kum = self._bessel_array(v, a=a, teta=teta, k=k, chih2=chih2)
+        else:
+            kum = self._kummer_array(kap, acmax * (1 - (v / a) ** 2))
+
+        profile = kum * numpy.exp(1j * k * 0.5 * v ** 2 * (1 / q - mu1 / self._R))
+        integral, integral_coarse = _cosine_sums_numba(numpy.ascontiguousarray(xx, dtype=float), v,
+                                                       _trapezoid_weights(v) * profile,
+                                                       _coarse_trapezoid_weights(v) * profile,
+                                                       k / q, -1j * k * kiny * v)
+
+        factor = 2 * numpy.sqrt(att / numpy.abs(lambda1 * q))
+        if return_error:
+            return integral * factor, numpy.abs(integral - integral_coarse) / 3 * numpy.abs(factor)
+        return integral * factor
+
+    def _equation30_2016_numba(self, xx,
+                               a=None, mu1=None, mu2=None, teta=None, teta1=None, alfa=None, acrist=None,
+                               gamma=None, lambda1=None, omega=None, t1=None, a2=None, g=None, kap=None, k=None,
+                               chih2=None, return_error=False, **kwds):
+
+        v = numpy.linspace(-a, a, self._integration_points)
+        if alfa == 0:
+            kum = self._bessel_array(v, a=a, teta=teta, k=k, chih2=chih2)
+        else:
+            kum = self._kummer_array(kap, acrist * gamma * numpy.maximum(a ** 2 - v ** 2, 0) / (numpy.sin(2 * teta)) ** 2)
+
+        profile = gamma / numpy.sqrt(lambda1 * self._p) * kum
+        pe = 1 / (1 / self._p - mu2 / self._R)
+        integral, integral_coarse = _equation30_sums_numba(numpy.ascontiguousarray(xx, dtype=float), v,
+                                                           _trapezoid_weights(v) * profile,
+                                                           _coarse_trapezoid_weights(v) * profile,
+                                                           k, gamma, pe, mu1, self._R, t1 * numpy.sin(teta1),
+                                                           a2, complex(omega), g, a)
+        if return_error:
+            return integral, numpy.abs(integral - integral_coarse) / 3
+        return integral
+
+    def _equation31_2016_numba(self, xx, q,
+                               a=None, mu1=None, teta=None, alfa=None, k=None, pe=None, kap=None, acmax=None,
+                               kiny=None, chih2=None, g=None, return_error=False, **kwds):
+
+        qe = q * self._R / (self._R - q * mu1 - g * q)
+        be = 1 / qe + 1 / pe
+        invle = 1 / (pe + qe) + g / self._R
+
+        v = numpy.linspace(-a, a, self._integration_points)
+        if alfa == 0:
+            kum = self._bessel_array(v, a=a, teta=teta, k=k, chih2=chih2)
+        else:
+            kum = self._kummer_array(kap, acmax * (1 - (v / a) ** 2))
+
+        profile = kum * numpy.exp(1j * k * 0.5 * v ** 2 * invle - k * v * kiny)
+        integral, integral_coarse = _cosine_sums_numba(numpy.ascontiguousarray(xx, dtype=float), v,
+                                                       _trapezoid_weights(v) * profile,
+                                                       _coarse_trapezoid_weights(v) * profile,
+                                                       k / (q * pe * be), numpy.zeros(v.size, dtype=complex))
+
+        factor = self._equation31_2016_factor(xx, q, be, a=a, g=g, k=k, **kwds)
+        if return_error:
+            return integral * factor, numpy.abs(integral - integral_coarse) / 3 * numpy.abs(factor)
+        return integral * factor
+
+    #
+    # integration along the second axis of integrand(xx, v) for v in [lower, upper]. Returns the integrals and an
+    # estimate of their absolute errors, for each x.
+    #
+    #
+    # precision of the (x, v) arrays of the vectorized engine. In single precision, the phases are calculated in
+    # float64 and reduced to [0, 2 pi) before the conversion, and the sums over v are accumulated in complex128.
+    #
+
+    def _working_precision(self, array):
+        if self._precision == "double":
+            return array
+        return numpy.asarray(array, dtype=numpy.complex64)
+
+    # exp(i phase) for a real phase (a temporary array, reduced in place in single precision)
+    def _cis(self, phase):
+        if self._precision == "double":
+            return numpy.exp(1j * phase)
+        phase = numpy.remainder(phase, 2 * numpy.pi, out=phase).astype(numpy.float32)
+        out = numpy.empty(phase.shape, dtype=numpy.complex64)
+        numpy.cos(phase, out=out.real)
+        numpy.sin(phase, out=out.imag)
+        return out
+
+    # cos(phase - i damping) for a real phase (as in _cis) and a real damping, broadcast to phase
+    def _cos(self, phase, damping=0.0):
+        if self._precision == "double":
+            return numpy.cos(phase - 1j * damping)
+        phase = numpy.remainder(phase, 2 * numpy.pi, out=phase).astype(numpy.float32)
+        if numpy.all(damping == 0):
+            return numpy.cos(phase)
+        damping = numpy.asarray(damping, dtype=numpy.float32)
+        out = numpy.empty(phase.shape, dtype=numpy.complex64)
+        numpy.multiply(numpy.cos(phase), numpy.cosh(damping), out=out.real)
+        numpy.multiply(numpy.sin(phase), numpy.sinh(damping), out=out.imag)
+        return out
+
+    # sum along the last axis, accumulated in complex128
+    @staticmethod
+    def _sum_v(y):
+        return numpy.add.reduce(y, axis=-1, dtype=numpy.complex128)
+
+    @_timed("integration")
+    def _integrate(self, integrand, xx, lower, upper):
+        if self._profile is not None:
+            kernel = integrand
+            def integrand(xx, v):
+                with self._timer("kernel"):
+                    return kernel(xx, v)
+
+        if self._integration_method == "trapezoid" and self._precision != "double":
+            v = numpy.linspace(lower, upper, self._integration_points)
+            y = integrand(xx, v)
+            integral = self._sum_v(y * _trapezoid_weights(v).astype(numpy.float32))
+            error = numpy.abs(integral - self._sum_v(y * _coarse_trapezoid_weights(v).astype(numpy.float32))) / 3
+            return integral, error
+
+        if self._integration_method == "trapezoid":
+            v = numpy.linspace(lower, upper, self._integration_points)
+            y = integrand(xx, v)
+            integral = trapezoid(y, x=v, axis=1)
+            # Richardson estimate, from the trapezoid rule on every other point
+            icoarse = numpy.unique(numpy.append(numpy.arange(0, v.size, 2), v.size - 1))
+            error = numpy.abs(integral - trapezoid(y[:, icoarse], x=v[icoarse], axis=1)) / 3
+            return integral, error
+
+        # Gauss-Legendre, doubling the number of points for the x values not yet converged: the error is
+        # estimated as the difference with the previous order, and compared with the integral of |integrand|
+        npoints = _QUADRATURE_MIN_POINTS
+        integral, scale = self._gauss_legendre(integrand, xx, lower, upper, npoints)
+        error = numpy.full(xx.shape, numpy.inf)
+        todo = numpy.arange(xx.size)
+        while todo.size > 0 and npoints < _QUADRATURE_MAX_POINTS:
+            npoints *= 2
+            new_integral, scale[todo] = self._gauss_legendre(integrand, xx[todo], lower, upper, npoints)
+            error[todo] = numpy.abs(new_integral - integral[todo])
+            integral[todo] = new_integral
+            todo = todo[error[todo] > self._integration_tolerance * scale[todo]]
+
+        if todo.size > 0:
+            print("Integration not converged for %d x values (%d points, tolerance %g)" %
+                  (todo.size, npoints, self._integration_tolerance))
+        return integral, error
+
+    @staticmethod
+    def _gauss_legendre(integrand, xx, lower, upper, npoints):
+        nodes, weights = _legendre_roots(npoints)
+        v = 0.5 * (upper - lower) * nodes + 0.5 * (upper + lower)
+        weights = 0.5 * numpy.abs(upper - lower) * weights
+        y = integrand(xx, v)
+        if y.dtype == numpy.complex64: # accumulated in complex128
+            weights = weights.astype(numpy.float32)
+            return LaueCrystalFocusing._sum_v(y * weights), LaueCrystalFocusing._sum_v(numpy.abs(y) * weights).real
+        return numpy.dot(y, weights), numpy.dot(numpy.abs(y), weights)
+
     #
     # pack constants
     #
 
-    def _calculate_constats_for_equation23_2016(self):
+    # constants used by all the equations (Guigay & Ferrero 2016), computed once per scan
+    @_timed("constants")
+    def _calculate_constants(self):
         photon_energy_in_keV = self._photon_energy_in_keV
         p = self._p
         alfa = self._alfa_deg * numpy.pi / 180
@@ -688,7 +1928,8 @@ class LaueCrystalFocusing():
         kp2 = kp * numpy.sin(2 * teta)
 
         #
-        # TODO: Not working for alfa_deg=0
+        # alfa_deg=0 (symmetric Laue): acrist=acmax=0, the Kummer function is replaced by J0 (see _bessel_array) and
+        # kap is set to infinity
         #
 
 
@@ -703,7 +1944,6 @@ class LaueCrystalFocusing():
 
         t1 = thickness / gam1
         t2 = thickness / gam2
-        qpoly = p * R * gam2 / (2 * p + R * gam1)
         att = numpy.exp(-k * 0.5 * (t1 + t2) * numpy.imag(chizero))
         s2max = 0.25 * t1 * t2
         u2max = u2 * s2max  # Omega = k**2 chi_h chi_hbar / 4 ? (end of pag 490)
@@ -727,7 +1967,8 @@ class LaueCrystalFocusing():
 
         acmax = acrist * s2max
         g = gamma * acrist * R / kp2
-        kap = u2max / acmax  # beta = Omega / A TODO acmax is zero when alfa is zero!!!!!!!!!!!!!!!!!!
+        kap = u2max / acmax if acmax != 0 else numpy.inf  # beta = Omega / A (not used if alfa=0)
+        if alfa != 0: self._prepare_kummer_table(kap, acmax)
 
         pe = p * R / (gamma ** 2 * (R - p * mu2) - g * p)
 
@@ -743,7 +1984,6 @@ class LaueCrystalFocusing():
             print("acrist, com:", acrist, 0)
             print("pe:", pe)
             print("a: ", a, thickness * numpy.sin(teta))
-            print("pe:", pe)
 
         omega = 0.25 * (t1 - t2) * chizero / a  # omega following the definition found after eq 22
         omega_real = numpy.real(omega)
@@ -776,291 +2016,549 @@ class LaueCrystalFocusing():
             "chih2"   : chih2,
             }
 
+    def _calculate_constats_for_equation23_2016(self):
+        return self._calculate_constants()
 
-    def _calculate_constats_for_equation30_2016(self):
-        photon_energy_in_keV = self._photon_energy_in_keV
-        p = self._p
-        alfa = self._alfa_deg * numpy.pi / 180
-        R = self._R
-        poisson_ratio = self._poisson_ratio
-        thickness = self._thickness
-
-        teta, chizero, chih = self.get_crystal_data()
-
-        lambda1 = codata.h * codata.c / codata.e / (photon_energy_in_keV * 1e3) * 1e3  # in mm
-        chimh = -1j * chih
-        chih2 = chih * chimh
+    def _calculate_constats_for_equation30_2016(self, kwds=None):
+        if kwds is None: kwds = self._calculate_constants()
+        return {key: kwds[key] for key in ("a", "mu1", "mu2", "teta", "teta1", "teta2", "alfa", "acrist", "gamma",
+                                           "lambda1", "omega", "t1", "a2", "g", "kap", "k", "chih2")}
 
-        if self._verbose:
-            print("photon_energy_in_keV:", photon_energy_in_keV)
-            print("lambda1 in mm:", lambda1)
-            print("lambda1 in m, A:", lambda1 * 1e-3, lambda1 * 1e-3 * 1e10)
-            print("CrystalSi 111")
-            print("teta_deg:", teta * 180 / numpy.pi)
-            print("p:", p)
-            print("R:", R)
-            print("chizero:", chizero)
-            print("chih:", chih)
-            print("chimh:", chimh)
-            print("chih*chihbar:", chih2)
+    def _calculate_constats_for_equation31_2016(self):
+        return self._calculate_constants()
 
+    #
+    # q-scan % Guigay&Ferrero 2016 eq 31
+    #
+    def qscan(self, qmin=0.0, qmax=10000.0, npoints=10):
 
+        print("Calculating q-scan at p=%.3f mm..." % self._p)
+        t0 = time.time()
+        # the cache is read first, so a hit skips the constants (and the Kummer table)
+        key, cached = self._read_result_cache(scan="qscan", qmin=qmin, qmax=qmax, npoints=npoints)
+        if cached is not None:
+            self._error_estimate = None
+            return tuple(cached)
 
-        k = 2 * numpy.pi / lambda1
-        h = 2 * k * numpy.sin(teta)
+        qq = numpy.linspace(qmin, qmax, npoints)
+        yy_amplitude = numpy.zeros_like(qq, dtype=complex)
 
+        kwds_eq31 = self._calculate_constats_for_equation31_2016()
+        kwds_eq30 = self._calculate_constats_for_equation30_2016(kwds_eq31)
+        a = kwds_eq31['a']
 
-        u2 = 0.25 * chih2 * k ** 2
-        raygam = R * numpy.cos(teta)
-        kp = k * numpy.sin(2 * teta)
-        kp2 = kp * numpy.sin(2 * teta)
+        chunk_size = 1 if self._n_workers <= 1 else int(numpy.ceil(qq.size / (4 * self._n_workers)))
+        chunks = [qq[i:i + chunk_size] for i in range(0, qq.size, chunk_size)]
+        yy_amplitude[:] = numpy.concatenate(self._map_chunks("_qscan_block", chunks, kwds_eq30, kwds_eq31))
+        self._write_result_cache(key, qq, yy_amplitude)
+        print("Calculation time: ", time.time() - t0)
 
-        #
-        # TODO: Not working for alfa_deg=0
-        #
+        return qq, yy_amplitude
 
+    @_timed("kernel")
+    def _qscan_block(self, qq, kwds_eq30, kwds_eq31):
+        yy_amplitude = numpy.zeros_like(qq, dtype=complex)
+        for j in range(qq.size):
+            yy_amplitude[j] = self._qscan_amplitude(qq[j], kwds_eq30, kwds_eq31)
+        return yy_amplitude
 
-        teta1 = alfa + teta
-        teta2 = alfa - teta
-        SG = None
-        fam1 = numpy.sin(teta1)
-        fam2 = numpy.sin(teta2)
-        gam1 = numpy.cos(teta1)
-        gam2 = numpy.cos(teta2)
+    # amplitude at x=0 for a given q (one point of the q-scan)
+    def _qscan_amplitude(self, q, kwds_eq30, kwds_eq31):
+        if self._use_array_kernels(kwds_eq31["alfa"]):
+            x0 = numpy.zeros(1)
+            if q == 0:
+                if self._p == 0.0:
+                    return self._equation23_2016_array(x0, **kwds_eq31)[0]
+                else:
+                    return self._equation30_2016_array(x0, **kwds_eq30)[0]
+            else:
+                if self._p == 0.0:
+                    return self._equation24_2016_array(x0, q, **kwds_eq31)[0]
+                else:
+                    return self._equation31_2016_array(x0, q, **kwds_eq31)[0]
 
+        if q == 0:
+            if self._p == 0.0:
+                amplitude = self._equation23_2016(q, **kwds_eq31)
+            else:
+                xcenter = 0.0 # TODO calculate the x value that corresponds to the symmetry center
+                amplitude = self._equation30_2016(xcenter, **kwds_eq30)
+        else:
+            if self._p == 0.0:
+                amplitude = self._equation24_2016(0, q, **kwds_eq31)
+            else:
+                amplitude = self._equation31_2016(0, q, **kwds_eq31)
+        return amplitude
 
-        t1 = thickness / gam1
-        t2 = thickness / gam2
-        qpoly = p * R * gam2 / (2 * p + R * gam1)
-        att = numpy.exp(-k * 0.5 * (t1 + t2) * numpy.imag(chizero))
-        s2max = 0.25 * t1 * t2
-        u2max = u2 * s2max  # Omega = k**2 chi_h chi_hbar / 4 ? (end of pag 490)
-        gamma = t2 / t1
-        a = numpy.sin(2 * teta) * t1 * 0.5
-        kin = 0.25 * (t1 - t2) * chizero / a
-        kinx = numpy.real(kin)
-        kiny = numpy.imag(kin)
-        com = numpy.sin(alfa) * (1 + gam1 * gam2 * (1 + poisson_ratio))
-        kp3 = 0.5 * k * (gamma * a) ** 2
-        mu1 = (numpy.cos(alfa) * 2 * fam1 * gam1 + numpy.sin(alfa) * (fam1 ** 2 + poisson_ratio * gam1 ** 2)) / (
-                    numpy.sin(2 * teta) * numpy.cos(teta))
-        mu2 = (numpy.cos(alfa) * 2 * fam2 * gam2 + numpy.sin(alfa) * (fam2 ** 2 + poisson_ratio * gam2 ** 2)) / (
-                    numpy.sin(2 * teta) * numpy.cos(teta))
-        a1 = (thickness / numpy.cos(teta)) * (
-                    numpy.cos(alfa) * numpy.sin(teta1) + poisson_ratio * numpy.sin(alfa) * numpy.cos(teta1))
-        a2 = (thickness / numpy.cos(teta)) * (
-                    numpy.cos(alfa) * numpy.sin(teta2) + poisson_ratio * numpy.sin(alfa) * numpy.cos(teta2))
-        acrist = -h * com / R  # A in Eq 17
+    #
+    # caustic map: x-scans for many q values (Guigay & Ferrero 2016 eq 31, or eq 24 if p=0)
+    #
+    def caustic_map(self, q_array, npoints_x=10, a_factor=1, a_center=0.0, filename="", method="direct", stream=None):
 
+        qq = numpy.array(q_array, dtype=float).reshape(-1)
 
-        acmax = acrist * s2max
-        g = gamma * acrist * R / kp2
-        kap = u2max / acmax  # beta = Omega / A TODO acmax is zero when alfa is zero!!!!!!!!!!!!!!!!!!
+        print("Calculating caustic map at p=%.3f mm for %d q values..." % (self._p, qq.size))
+        t0 = time.time()
 
-        pe = p * R / (gamma ** 2 * (R - p * mu2) - g * p)
+        # the cache is read first, so a hit skips the constants (and the Kummer table)
+        key, cached = self._read_result_cache(stream, scan="caustic_map", q_array=qq.tolist(), npoints_x=npoints_x,
+                                              a_factor=a_factor, a_center=a_center, method=method)
+        if cached is not None:
+            xx, yy_amplitude = cached
+            self._error_estimate = None
+            self._precision_deviation = None
+        else:
+            kwds = self._calculate_constants()
+            a = kwds['a']
+            xx = numpy.linspace(-a * a_factor, a * a_factor, npoints_x) - a_center
+            yy_amplitude = self._caustic_map_amplitude(qq, xx, kwds, npoints_x=npoints_x, a_factor=a_factor,
+                                                       a_center=a_center, method=method, stream=stream)
+            self._write_result_cache(key, xx, yy_amplitude)
 
-        # WARNING DIFFERNT FROM Fig 2 (+p)
+        print("Calculation time: ", time.time() - t0)
 
-        # pe = p * R / (gamma**2 * (R + p * mu2) - g * p)
-        if self._verbose:
-            print("alfa:", alfa)
-            print("teta1, teta2, teta:", teta1, teta2, teta)
-            print("t1, t2, t/cos(teta):", t1, t2, thickness / numpy.cos(teta))
-            print("a1, a2:", a1, a2, +thickness * numpy.tan(teta), -thickness * numpy.tan(teta))
-            print("mu1, mu2:", mu1, mu2, +1 / numpy.cos(teta), -1 / numpy.cos(teta))
-            print("acrist, com:", acrist, 0)
-            print("pe:", pe)
-            print("a: ", a, thickness * numpy.sin(teta))
+        # create and write wofry wavefronts (one per q)
+        output_wavefronts = []
+        for j in range(qq.size):
+            output_wavefronts.append(self._create_output_wavefront(xx, yy_amplitude[j], filename=filename,
+                                                                   subgroupname="wfr_%05d" % j, overwrite=(j == 0)))
 
-        omega = 0.25 * (t1 - t2) * chizero / a  # omega following the definition found after eq 22
-        omega_real = numpy.real(omega)
-        omega_imag = numpy.imag(omega)
-        xc_over_q = omega_real - t1 * numpy.sin(alfa + teta) / (2 * R)
+        return qq, xx, yy_amplitude, output_wavefronts
 
-        return {
-            "a"       : a,
-            "mu1"     : mu1,
-            "mu2"     : mu2,
-            "teta"    : teta,
-            "teta1"   : teta1,
-            "teta2"   : teta2,
-            "alfa"    : alfa,
-            "acrist"  : acrist,
-            "gamma"   : gamma,
-            "lambda1" : lambda1,
-            "omega"   : omega,
-            "t1"      : t1,
-            "a2"      : a2,
-            "g"       : g,
-            "kap"     : kap,
-            "k"       : k,
-            "chih2"   : chih2,
-            }
+    # (q, x) amplitudes of the caustic map
+    def _caustic_map_amplitude(self, qq, xx, kwds, npoints_x=10, a_factor=1, a_center=0.0, method="direct", stream=None):
+        yy_amplitude = numpy.zeros((qq.size, xx.size), dtype=complex)
 
+        iq = numpy.flatnonzero(qq != 0)
+        if stream is not None: # same blocks for any n_workers
+            nchunks = _STREAM_BLOCKS
+        else:
+            nchunks = 10 if self._n_workers <= 1 else 4 * self._n_workers
+        chunk_size = max(1, int(numpy.ceil(iq.size / nchunks)))
+        if stream is not None:
+            stream.set_scan("caustic_map", self._stream_signature(q_array=qq.tolist(), npoints_x=npoints_x,
+                                                                  a_factor=a_factor, a_center=a_center, method=method))
+            stream.begin([iq[i:i + chunk_size] for i in range(0, iq.size, chunk_size)], xx, qq=qq,
+                         block_size=chunk_size)
+
+        try:
+            # q=0 planes (equation 23 or 30)
+            for j in numpy.flatnonzero(qq == 0):
+                if self._p == 0:
+                    yy_amplitude[j] = self._equation23_2016_array(xx, **kwds)
+                else:
+                    yy_amplitude[j] = self._equation30_2016_array(xx,
+                                                                  **self._calculate_constats_for_equation30_2016(kwds))
+                if stream is not None:
+                    stream.write(j, yy_amplitude[j])
+
+            # finite q planes: the v-dependent factors of the integrand are common to all of them
+            if iq.size > 0:
+                v, factor = self._caustic_factors(**kwds)
+                chunks = [qq[iq[i:i + chunk_size]] for i in range(0, iq.size, chunk_size)]
+                yy_amplitude[iq] = numpy.concatenate(self._map_chunks("_caustic_block", chunks, xx, v, factor, kwds,
+                                                                      method, stream=stream))
+                if self._precision != "double":
+                    iq_check = iq[:max(1, iq.size // 10)]
+                    self._check_precision(yy_amplitude[iq_check], xx, "_caustic_qx_block", qq[iq_check], v, factor,
+                                          kwds, method)
+            if stream is not None:
+                stream.end()
+        finally:
+            if stream is not None:
+                stream.close()
+
+        return yy_amplitude
+
+    # v-dependent (q-independent) factors of the integrand of eq 31 (or eq 24 if p=0), times the integration weights
+    def _caustic_factors(self, a=None, teta=None, alfa=None, kap=None, k=None, acmax=None, kiny=None, chih2=None,
+                         **kwds):
+        if self._p == 0:
+            v = numpy.linspace(0, a, self._integration_points)
+        else:
+            v = numpy.linspace(-a, a, self._integration_points)
 
-    def _calculate_constats_for_equation31_2016(self):
-        photon_energy_in_keV = self._photon_energy_in_keV
-        p = self._p
-        alfa = self._alfa_deg * numpy.pi / 180
-        R = self._R
-        poisson_ratio = self._poisson_ratio
-        thickness = self._thickness
+        if alfa == 0:
+            kum = self._bessel_array(v, a=a, teta=teta, k=k, chih2=chih2)
+        else:
+            kum = self._kummer_array(kap, acmax * (1 - (v / a) ** 2))
+
+        factor = _trapezoid_weights(v) * kum
+        if self._p != 0:
+            factor *= numpy.exp(- k * v * kiny)
+        return v, factor
+
+    # _caustic_block with the arguments in (x, q, ...) order, for _check_precision
+    def _caustic_qx_block(self, xx, qq, v, factor, kwds, method="direct"):
+        return self._caustic_block(qq, xx, v, factor, kwds, method)
+
+    # caustic planes for an array of (non zero) q values, as a (q, x) array. The integral over v is a matrix product
+    # (method="direct") or two chirp-z transforms per q (method="czt", xx and v must be equally spaced)
+    @_timed("kernel")
+    def _caustic_block(self, qq, xx, v, factor, kwds, method="direct"):
+        a       = kwds["a"]
+        mu1     = kwds["mu1"]
+        teta1   = kwds["teta1"]
+        gamma   = kwds["gamma"]
+        lambda1 = kwds["lambda1"]
+        t1      = kwds["t1"]
+        t2      = kwds["t2"]
+        g       = kwds["g"]
+        k       = kwds["k"]
+        pe      = kwds["pe"]
+        kiny    = kwds["kiny"]
+        att     = kwds["att"]
+        chizero = kwds["chizero"]
 
-        teta, chizero, chih = self.get_crystal_data()
+        if self._p == 0:
+            invle = 1 / qq - mu1 / self._R
+            alpha = k / qq
+            shift = -1j * k * kiny * v
+        else:
+            qe = qq * self._R / (self._R - qq * mu1 - g * qq)
+            be = 1 / qe + 1 / pe
+            invle = 1 / (pe + qe) + g / self._R
+            alpha = k / (qq * pe * be)
+            shift = 0.0
+
+        # q-dependent quadratic phase times the common factors: (q, v)
+        G = factor[numpy.newaxis, :] * numpy.exp(1j * k * 0.5 * numpy.outer(invle, v ** 2))
+
+        amplitude = numpy.zeros((qq.size, xx.size), dtype=complex)
+        if method == "czt":
+            # cos(alpha x v + shift) = (exp(i alpha x v) exp(i shift) + exp(-i alpha x v) exp(-i shift)) / 2
+            for j in range(qq.size):
+                amplitude[j] = 0.5 * (_fourier_sum_czt(G[j] * numpy.exp(1j * shift), v, alpha[j], xx) +
+                                      _fourier_sum_czt(G[j] * numpy.exp(-1j * shift), v, -alpha[j], xx))
+        else:
+            # integral over v as a batched matrix product of cos(alpha x v) (q, x, v) with G (q, v)
+            x_block = max(1, min(xx.size, self._max_block_size // v.size))
+            for i0 in range(0, xx.size, x_block):
+                xv = numpy.outer(xx[i0:i0 + x_block], v)
+                q_block = max(1, self._max_block_size // xv.size)
+                for j0 in range(0, qq.size, q_block):
+                    if self._precision == "double":
+                        C = numpy.cos(alpha[j0:j0 + q_block, numpy.newaxis, numpy.newaxis] * xv[numpy.newaxis, :, :] + shift)
+                        amplitude[j0:j0 + q_block, i0:i0 + x_block] = numpy.einsum("qxv,qv->qx", C, G[j0:j0 + q_block],
+                                                                                   optimize=True)
+                    else:
+                        C = self._cos(alpha[j0:j0 + q_block, numpy.newaxis, numpy.newaxis] * xv[numpy.newaxis, :, :],
+                                      -numpy.imag(shift))
+                        amplitude[j0:j0 + q_block, i0:i0 + x_block] = self._sum_v(
+                            C * self._working_precision(G[j0:j0 + q_block, numpy.newaxis, :]))
+
+        x = xx[numpy.newaxis, :]
+        q = qq[:, numpy.newaxis]
+        if self._p == 0:
+            amplitude *= 2 * numpy.sqrt(att / numpy.abs(lambda1 * q))
+        else:
+            be = be[:, numpy.newaxis]
+            s = 0
+            amplitude *= numpy.sqrt(att / (lambda1 * q * self._p * be))
+            # omitted phase (see just after equation 30)
+            amplitude *= numpy.exp(1j * k * x ** 2 / 2 / q) * \
+                         numpy.exp(1j * k * s ** 2 / 2 / self._p) * \
+                         numpy.exp(1j * k * chizero.real * (t1 + t2) / 4)
+            # omitted phase (see just before equation 31)
+            m = g * a / self._R + gamma * (s / self._p + a ** 2 / 2 / self._R)  ## CHECK, shown after eq 30
+            amplitude *= numpy.exp(- 1j * (k / 2 / be) * \
+                                   (x / q + t1 * numpy.sin(teta1) / 2 / self._R + m) ** 2)
+        return amplitude
 
-        lambda1 = codata.h * codata.c / codata.e / (photon_energy_in_keV * 1e3) * 1e3  # in mm
-        chimh = -1j * chih
-        chih2 = chih * chimh
+    #
+    # polychromatic x-scan: incoherent sum of weights * |amplitude|^2 over the photon energies (keV), on the x grid
+    # of the nominal energy. Returns xx, intensity and a wavefront with amplitude sqrt(intensity) (and no phase).
+    #
+    def spectral_xscan(self, energies, weights=None, q=1000.0, npoints_x=10, a_factor=1, a_center=0.0, filename="",
+                       method="direct"):
 
-        if self._verbose:
-            print("photon_energy_in_keV:", photon_energy_in_keV)
-            print("lambda1 in mm:", lambda1)
-            print("lambda1 in m, A:", lambda1 * 1e-3, lambda1 * 1e-3 * 1e10)
-            print("CrystalSi 111")
-            print("teta_deg:", teta * 180 / numpy.pi)
-            print("p:", p)
-            print("R:", R)
-            print("chizero:", chizero)
-            print("chih:", chih)
-            print("chimh:", chimh)
-            print("chih*chihbar:", chih2)
+        energies = numpy.array(energies, dtype=float).reshape(-1)
+        if weights is None:
+            weights = numpy.ones_like(energies) / energies.size
+        weights = numpy.array(weights, dtype=float).reshape(-1)
+        if weights.size != energies.size:
+            raise Exception("energies and weights must have the same size (%d, %d)" % (energies.size, weights.size))
 
+        a = self._calculate_constants()['a']
+        xx = numpy.linspace(-a * a_factor, a * a_factor, npoints_x) - a_center
 
+        print("Calculating spectral x-scan at p=%.3f mm, q=%.3f mm for %d energies in [%.4f, %.4f] keV..." %
+              (self._p, q, energies.size, energies.min(), energies.max()))
+        t0 = time.time()
+        # chunks of (energies, weights), distributed over the process pool if n_workers > 1
+        chunk_size = 1 if self._n_workers <= 1 else int(numpy.ceil(energies.size / (4 * self._n_workers)))
+        chunks = [numpy.array([energies[i:i + chunk_size], weights[i:i + chunk_size]])
+                  for i in range(0, energies.size, chunk_size)]
+        intensity = numpy.zeros(xx.size)
+        for partial_intensity in self._map_chunks("_spectral_block", chunks, xx, q, method):
+            intensity += partial_intensity
+        print("Calculation time: ", time.time() - t0)
 
-        k = 2 * numpy.pi / lambda1
-        h = 2 * k * numpy.sin(teta)
+        output_wavefront = self._create_output_wavefront(xx, numpy.sqrt(intensity), filename=filename)
+
+        return xx, intensity, output_wavefront
+
+    # incoherent sum over the (energy, weight) pairs of a chunk. The instance is copied for each energy: only the
+    # crystal data (memoized) and the constants are recalculated, the geometry and the x grid are shared. The copies
+    # are silent (spectral_xscan reports the scan once).
+    def _spectral_block(self, chunk, xx, q, method):
+        intensity = numpy.zeros(xx.size)
+        for photon_energy_in_keV, weight in chunk.T:
+            laue = copy.copy(self)
+            laue._photon_energy_in_keV = photon_energy_in_keV
+            laue._kummer_table = None
+            laue._verbose = 0
+            intensity += weight * numpy.abs(laue._xscan_amplitude(xx, q, method)) ** 2
+        return intensity
+
+    # amplitudes of an x-scan on a given grid xx, without output (used for each energy of spectral_xscan)
+    def _xscan_amplitude(self, xx, q, method="direct"):
+        kwds = self._calculate_constants()
+        if q == 0:
+            if self._p == 0:
+                equation, args = "_equation23_2016", ()
+            else:
+                equation, args, kwds = "_equation30_2016", (), self._calculate_constats_for_equation30_2016(kwds)
+        elif method == "czt":
+            return self._xscan_czt(xx, q, kwds)
+        else:
+            equation, args = ("_equation24_2016" if self._p == 0 else "_equation31_2016"), (q,)
 
+        if not self._use_array_kernels(kwds["alfa"]):
+            return self._evaluate_scalar_block(xx, equation, *args, **kwds)
 
-        u2 = 0.25 * chih2 * k ** 2
-        raygam = R * numpy.cos(teta)
-        kp = k * numpy.sin(2 * teta)
-        kp2 = kp * numpy.sin(2 * teta)
+        # blocks of x limited to max_block_size (x, v) samples
+        chunk_size = max(1, self._max_block_size // self._integration_points)
+        return numpy.concatenate([self._evaluate_array_block(xx[i:i + chunk_size], equation, *args, **kwds)[0]
+                                  for i in range(0, xx.size, chunk_size)])
 
-        #
-        # TODO: Not working for alfa_deg=0
-        #
+    #
+    # focal distance: bounded Brent search in q, starting from the lens equation estimate p R gam2 / (2 p + R gam1)
+    # (its p -> infinity limit if p=0), maximizing the peak intensity (metric="intensity") or minimizing the FWHM
+    # (metric="fwhm") of x-scans on a fixed grid. The search is local: use q_bounds (mm) to select a focus if there are several.
+    # Returns a dictionary with the focal distance q, the peak intensity, its position x, the fwhm, the gain (peak
+    # intensity over the peak intensity at the crystal exit, q=0) and the number of x-scans calculated.
+    #
+    def find_focus(self, q_bounds=None, npoints_x=201, a_factor=2, a_center=0.0, metric="intensity",
+                   max_evaluations=12, xtol=1e-3, method="czt"):
 
+        if metric not in ("intensity", "fwhm"):
+            raise Exception("Unknown metric: %s (valid values are 'intensity' and 'fwhm')" % metric)
 
-        teta1 = alfa + teta
-        teta2 = alfa - teta
-        SG = None
-        fam1 = numpy.sin(teta1)
-        fam2 = numpy.sin(teta2)
-        gam1 = numpy.cos(teta1)
-        gam2 = numpy.cos(teta2)
+        kwds = self._calculate_constants()
+        gam1, gam2 = numpy.cos(kwds["teta1"]), numpy.cos(kwds["teta2"])
+        if self._p == 0:
+            q_estimate = self._R * gam2 / 2
+        else:
+            q_estimate = self._p * self._R * gam2 / (2 * self._p + self._R * gam1)
+        if q_bounds is None:
+            q_bounds = (0.25 * numpy.abs(q_estimate), 2.0 * numpy.abs(q_estimate))
 
+        xx = numpy.linspace(-kwds["a"] * a_factor, kwds["a"] * a_factor, npoints_x) - a_center
 
-        t1 = thickness / gam1
-        t2 = thickness / gam2
-        qpoly = p * R * gam2 / (2 * p + R * gam1)
-        att = numpy.exp(-k * 0.5 * (t1 + t2) * numpy.imag(chizero))
-        s2max = 0.25 * t1 * t2
-        u2max = u2 * s2max  # Omega = k**2 chi_h chi_hbar / 4 ? (end of pag 490)
-        gamma = t2 / t1
-        a = numpy.sin(2 * teta) * t1 * 0.5
-        kin = 0.25 * (t1 - t2) * chizero / a
-        kinx = numpy.real(kin)
-        kiny = numpy.imag(kin)
-        com = numpy.sin(alfa) * (1 + gam1 * gam2 * (1 + poisson_ratio))
-        kp3 = 0.5 * k * (gamma * a) ** 2
-        mu1 = (numpy.cos(alfa) * 2 * fam1 * gam1 + numpy.sin(alfa) * (fam1 ** 2 + poisson_ratio * gam1 ** 2)) / (
-                    numpy.sin(2 * teta) * numpy.cos(teta))
-        mu2 = (numpy.cos(alfa) * 2 * fam2 * gam2 + numpy.sin(alfa) * (fam2 ** 2 + poisson_ratio * gam2 ** 2)) / (
-                    numpy.sin(2 * teta) * numpy.cos(teta))
-        a1 = (thickness / numpy.cos(teta)) * (
-                    numpy.cos(alfa) * numpy.sin(teta1) + poisson_ratio * numpy.sin(alfa) * numpy.cos(teta1))
-        a2 = (thickness / numpy.cos(teta)) * (
-                    numpy.cos(alfa) * numpy.sin(teta2) + poisson_ratio * numpy.sin(alfa) * numpy.cos(teta2))
-        acrist = -h * com / R  # A in Eq 17
+        print("Finding focus at p=%.3f mm in q=[%.3f, %.3f] mm (lens equation estimate: %.3f mm)..." %
+              (self._p, q_bounds[0], q_bounds[1], q_estimate))
+        t0 = time.time()
 
+        scans = {}
+        def evaluate(q):
+            if q not in scans:
+                intensity = numpy.abs(self._xscan_amplitude(xx, q, method)) ** 2
+                scans[q] = (intensity.max(), xx[intensity.argmax()], self._fwhm(xx, intensity))
+                print("    q=%.3f mm: peak intensity %g, fwhm %g mm" % (q, scans[q][0], scans[q][2]))
+            return -scans[q][0] if metric == "intensity" else scans[q][2]
+
+        result = minimize_scalar(evaluate, bounds=q_bounds, method="bounded",
+                                                options=dict(maxiter=max_evaluations, xatol=xtol * numpy.abs(q_estimate)))
+
+        intensity_q0 = numpy.abs(self._xscan_amplitude(xx, 0.0)) ** 2
+        peak_intensity, x_peak, fwhm = scans[result.x]
+        focus = dict(q=result.x,
+                     intensity=peak_intensity,
+                     x=x_peak,
+                     fwhm=fwhm,
+                     gain=peak_intensity / intensity_q0.max(),
+                     evaluations=len(scans))
+
+        print("Focus at q=%.3f mm: peak intensity %g at x=%g mm, fwhm %g mm, gain %g (%d x-scans)" %
+              (focus["q"], focus["intensity"], focus["x"], focus["fwhm"], focus["gain"], focus["evaluations"]))
+        print("Calculation time: ", time.time() - t0)
+        return focus
 
-        acmax = acrist * s2max
-        g = gamma * acrist * R / kp2
-        kap = u2max / acmax  # beta = Omega / A TODO acmax is zero when alfa is zero!!!!!!!!!!!!!!!!!!
+    #
+    # parameter sweep: metrics for all the combinations of param_grid ({parameter: values}, the parameters are
+    # crystal_descriptor, hkl, R, poisson_ratio, photon_energy_in_keV, thickness, p and alfa_deg; the other ones are
+    # those of this instance). The combinations are grouped by crystal data (crystal, reflection and photon energy),
+    # each group is evaluated in the same process (memoized crystal data), and the groups are distributed over the
+    # process pool if n_workers > 1. metric is:
+    #   "focus": find_focus(**metric_options): q, intensity, x, fwhm, gain
+    #   "xscan": peak of the x-scan at q=metric_options["q"] (other options: npoints_x, a_factor, a_center, method):
+    #            intensity, x, fwhm
+    #   a callable(laue) returning a dictionary of metrics (it must be picklable if n_workers > 1)
+    # Returns a pandas DataFrame, one row per combination. If checkpoint is a file name (json), the rows are written
+    # as the groups are completed, and the rows already in the file (for the same sweep) are not recalculated.
+    #
+    def sweep(self, param_grid, metric="focus", metric_options=None, checkpoint=""):
+        import pandas
+
+        if metric_options is None: metric_options = {}
+        for name in param_grid:
+            if name not in SWEEP_PARAMETERS:
+                raise Exception("Unknown sweep parameter: %s (valid values are %s)" % (name, ", ".join(SWEEP_PARAMETERS)))
+        if isinstance(metric, str) and metric not in ("focus", "xscan"):
+            raise Exception("Unknown metric: %s (valid values are 'focus', 'xscan' or a callable)" % metric)
+
+        names = list(param_grid.keys())
+        combinations = [dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])]
+
+        # groups of combinations sharing crystal data
+        groups = {}
+        for index, combination in enumerate(combinations):
+            key = tuple(repr(combination.get(name, getattr(self, "_" + name)))
+                        for name in ("crystal_descriptor", "hkl", "photon_energy_in_keV"))
+            groups.setdefault(key, []).append(index)
+
+        # the checkpoint is reused with any n_workers, profile or verbose
+        signature = self._result_signature(param_grid={name: list(param_grid[name]) for name in names},
+                                           metric=getattr(metric, "__name__", metric), metric_options=metric_options)
+        rows = self._read_sweep_checkpoint(checkpoint, signature)
+        todo = [[index for index in group if str(index) not in rows] for group in groups.values()]
+        todo = [group for group in todo if len(group) > 0]
+
+        print("Sweeping %d combinations (%d groups of crystal data, %d combinations to calculate)..." %
+              (len(combinations), len(groups), sum(len(group) for group in todo)))
+        t0 = time.time()
+        chunks = [[(index, combinations[index]) for index in group] for group in todo]
+        for group_rows in self._map_chunks("_sweep_group", chunks, metric, metric_options):
+            for index, row in group_rows:
+                rows[str(index)] = row
+            if checkpoint != "":
+                with self._timer("io"):
+                    self._write_sweep_checkpoint(checkpoint, signature, rows)
+        print("Calculation time: ", time.time() - t0)
 
-        pe = p * R / (gamma ** 2 * (R - p * mu2) - g * p)
+        return pandas.DataFrame([dict(combinations[index], **rows[str(index)]) for index in range(len(combinations))])
+
+    # metrics for a list of (index, combination), in a single process
+    def _sweep_group(self, group, metric, metric_options):
+        out = []
+        for index, combination in group:
+            laue = copy.copy(self)
+            for name, value in combination.items():
+                setattr(laue, "_" + name, value)
+            laue._kummer_table = None
+            laue._n_workers = 1
+            laue._verbose = 0
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if metric == "focus":
+                        row = laue.find_focus(**metric_options)
+                        row.pop("evaluations")
+                    elif metric == "xscan":
+                        row = laue._xscan_metrics(**metric_options)
+                    else:
+                        row = metric(laue)
+                row = {key: float(value) for key, value in row.items()}
+            except Exception as e:
+                print("Sweep combination %s failed: %s" % (combination, e))
+                row = {}
+            out.append((index, row))
+        return out
 
-        # WARNING DIFFERNT FROM Fig 2 (+p)
+    # peak intensity, its position x and fwhm of an x-scan at q
+    def _xscan_metrics(self, q=1000.0, npoints_x=201, a_factor=2, a_center=0.0, method="direct"):
+        a = self._calculate_constants()["a"]
+        xx = numpy.linspace(-a * a_factor, a * a_factor, npoints_x) - a_center
+        intensity = numpy.abs(self._xscan_amplitude(xx, q, method)) ** 2
+        return dict(intensity=intensity.max(), x=xx[intensity.argmax()], fwhm=self._fwhm(xx, intensity))
+
+    @staticmethod
+    def _read_sweep_checkpoint(checkpoint, signature):
+        if checkpoint == "" or not os.path.exists(checkpoint):
+            return {}
+        with open(checkpoint) as f:
+            data = json.load(f)
+        if data.get("signature") != signature:
+            print("Checkpoint %s is for a different sweep: starting again" % checkpoint)
+            return {}
+        print("Resuming sweep from %s (%d combinations done)" % (checkpoint, len(data["rows"])))
+        return data["rows"]
+
+    # the file is replaced at once, so it is never left incomplete
+    @staticmethod
+    def _write_sweep_checkpoint(checkpoint, signature, rows):
+        with open(checkpoint + ".tmp", "w") as f:
+            json.dump(dict(signature=signature, rows=rows), f)
+        os.replace(checkpoint + ".tmp", checkpoint)
+
+    # full width at half maximum of the peak of intensity (linear interpolation of the half maximum crossings)
+    @staticmethod
+    def _fwhm(xx, intensity):
+        i = intensity.argmax()
+        half = 0.5 * intensity[i]
+        below = numpy.flatnonzero(intensity[:i] < half)
+        above = numpy.flatnonzero(intensity[i:] < half)
+        if below.size == 0 or above.size == 0:
+            return xx[-1] - xx[0] # peak wider than the grid
+        j1 = below[-1]
+        j2 = i + above[0]
+        x1 = xx[j1] + (half - intensity[j1]) * (xx[j1 + 1] - xx[j1]) / (intensity[j1 + 1] - intensity[j1])
+        x2 = xx[j2 - 1] + (half - intensity[j2 - 1]) * (xx[j2] - xx[j2 - 1]) / (intensity[j2] - intensity[j2 - 1])
+        return x2 - x1
 
-        # pe = p * R / (gamma**2 * (R + p * mu2) - g * p)
-        if self._verbose:
-            print("alfa:", alfa)
-            print("teta1, teta2, teta:", teta1, teta2, teta)
-            print("t1, t2, t/cos(teta):", t1, t2, thickness / numpy.cos(teta))
-            print("a1, a2:", a1, a2, +thickness * numpy.tan(teta), -thickness * numpy.tan(teta))
-            print("mu1, mu2:", mu1, mu2, +1 / numpy.cos(teta), -1 / numpy.cos(teta))
-            print("acrist, com:", acrist, 0)
-            print("pe:", pe)
-            print("a: ", a, thickness * numpy.sin(teta))
-            print("pe:", pe)
+    #
+    # 2D x-scan (separable model): meridional Laue amplitude (x-scan at q) times the sagittal amplitude, propagated in
+    # free space from the crystal to q. The sagittal amplitude at the crystal is either sagittal_wavefront
+    # (GenericWavefront1D, abscissas in m) or a uniform aperture of width sagittal_aperture (mm) illuminated from
+    # the source at p (plane wave if p=0). sagittal_focal_length (mm) adds the thin lens phase of a sagittally bent
+    # crystal (0: no sagittal focusing). Returns xx, zz (mm), the (npoints_x, npoints_z) amplitude and a
+    # GenericWavefront2D (in m).
+    #
+    def xscan_2d(self, q=1000.0, npoints_x=10, a_factor=1, a_center=0.0, sagittal_wavefront=None, npoints_z=100,
+                 z_window=2.0, sagittal_aperture=1.0, sagittal_focal_length=0.0, filename="", method="direct"):
 
-        omega = 0.25 * (t1 - t2) * chizero / a  # omega following the definition found after eq 22
-        omega_real = numpy.real(omega)
-        omega_imag = numpy.imag(omega)
-        xc_over_q = omega_real - t1 * numpy.sin(alfa + teta) / (2 * R)
+        xx, yy_amplitude, _ = self.xscan(q=q, npoints_x=npoints_x, a_factor=a_factor, a_center=a_center, method=method)
 
-        return {
-            "a"       : a,
-            "mu1"     : mu1,
-            "mu2"     : mu2,
-            "teta"    : teta,
-            "teta1"   : teta1,
-            "teta2"   : teta2,
-            "alfa"    : alfa,
-            "acrist"  : acrist,
-            "gamma"   : gamma,
-            "lambda1" : lambda1,
-            "omega"   : omega,
-            "t1"      : t1,
-            "a2"      : a2,
-            "g"       : g,
-            "kap"     : kap,
-            "k"       : k,
-            "pe"      : pe,           # used in eq 31
-            "acmax"   : acmax,        # used in eq 31
-            "kiny"    : kiny,         # used in eq 31
-            "att"     : att,          # used in eq 31
-            "chizero" : chizero,      # used in eq 31
-            "t2"      : t2,           # used in eq 31
-            "chih2"   : chih2,        # used in eq 31
-            }
+        lambda1 = codata.h * codata.c / codata.e / (self._photon_energy_in_keV * 1e3) * 1e3  # in mm
+        if sagittal_wavefront is None:
+            zz = numpy.linspace(-0.5 * z_window, 0.5 * z_window, npoints_z)
+            zz_amplitude = numpy.where(numpy.abs(zz) <= 0.5 * sagittal_aperture, 1.0 + 0j, 0j)
+            if self._p != 0:
+                zz_amplitude *= numpy.exp(1j * numpy.pi / lambda1 * zz ** 2 / self._p)
+        else:
+            zz = 1e3 * sagittal_wavefront.get_abscissas()
+            zz_amplitude = numpy.array(sagittal_wavefront.get_complex_amplitude(), dtype=complex)
 
-    #
-    # q-scan % Guigay&Ferrero 2016 eq 31
-    #
-    def qscan(self, qmin=0.0, qmax=10000.0, npoints=10):
+        if sagittal_focal_length != 0:
+            zz_amplitude = zz_amplitude * numpy.exp(-1j * numpy.pi / lambda1 * zz ** 2 / sagittal_focal_length)
 
-        qq = numpy.linspace(qmin, qmax, npoints)
-        yy_amplitude = numpy.zeros_like(qq, dtype=complex)
+        # local frequency of the quadratic phases at the edge of the illuminated region vs. Nyquist frequency
+        if sagittal_wavefront is None:
+            curvature = (1 / self._p if self._p != 0 else 0) - (1 / sagittal_focal_length if sagittal_focal_length != 0 else 0)
+            if 0.5 * min(sagittal_aperture, z_window) * numpy.abs(curvature) / lambda1 > 0.5 / (zz[1] - zz[0]):
+                print("Warning: sagittal phase undersampled, increase npoints_z or reduce z_window")
+        zz_amplitude = self._propagate_sagittal(zz, zz_amplitude, q, lambda1)
 
-        kwds_eq30 = self._calculate_constats_for_equation30_2016()
-        kwds_eq31 = self._calculate_constats_for_equation31_2016()
-        a = kwds_eq31['a']
+        # outer product: the 2D array is the only (npoints_x, npoints_z) object, no kernel is formed
+        amplitude = numpy.outer(yy_amplitude, zz_amplitude)
 
-        print("Calculating q-scan at p=%.3f mm..." % self._p)
-        t0 = time.time()
-        print(f"Progress: 0%")
-        for j in range(qq.size):
-            progress = (j + 1) / qq.size * 100
-            if progress % 10 < (1 / qq.size * 100):  print(f"Progress: {progress:.0f}%")
+        output_wavefront = GenericWavefront2D.initialize_wavefront_from_arrays(1e-3 * xx, 1e-3 * zz, amplitude,
+                                                                               wavelength=1e-10)
+        output_wavefront.set_photon_energy(1e3 * self._photon_energy_in_keV)
+        if filename != "":
+            output_wavefront.save_h5_file(filename, subgroupname="wfr", intensity=True, phase=False, overwrite=True,
+                                          verbose=False)
+            print("File %s written to disk" % filename)
 
-            if qq[j] == 0:
-                if self._p == 0.0:
-                    amplitude = self._equation23_2016(qq[j], **kwds_eq31)
-                else:
-                    xcenter = 0.0 # TODO calculate the x value that corresponds to the symmetry center
-                    amplitude = self._equation30_2016(xcenter, **kwds_eq30)
-                yy_amplitude[j] = amplitude
-            else:
-                if self._p == 0.0:
-                    amplitude = self._equation24_2016(0, qq[j], **kwds_eq31)
-                else:
-                    amplitude = self._equation31_2016(0, qq[j], **kwds_eq31)
-                yy_amplitude[j] = amplitude
-        print(f"Progress: 100%")
-        print("Calculation time: ", time.time() - t0)
+        return xx, zz, amplitude, output_wavefront
 
-        return qq, yy_amplitude
+    # 1D Fresnel propagation (transfer function in the Fourier space) over the distance q (mm), on the grid zz (mm)
+    @staticmethod
+    def _propagate_sagittal(zz, zz_amplitude, q, lambda1):
+        if q == 0:
+            return zz_amplitude
+        frequencies = numpy.fft.fftfreq(zz.size, d=zz[1] - zz[0])
+        return numpy.fft.ifft(numpy.fft.fft(zz_amplitude) * numpy.exp(-1j * numpy.pi * lambda1 * q * frequencies ** 2))
 
     def info(self):
         txt = ""
@@ -1073,6 +2571,13 @@ class LaueCrystalFocusing():
         txt += "\nself._p                     = %f mm" % (self._p                   )
         txt += "\nself._alfa_deg              = %f deg" % (self._alfa_deg            )
         txt += "\nself._integration_points    = %s " % (self._integration_points  )
+        txt += "\nself._engine                = %s " % (self._engine              )
+        txt += "\nself._kummer_table_tolerance = %g " % (self._kummer_table_tolerance)
+        txt += "\nself._n_workers             = %d " % (self._n_workers           )
+        txt += "\nself._integration_method    = %s " % (self._integration_method  )
+        txt += "\nself._integration_tolerance = %g " % (self._integration_tolerance)
+        txt += "\nself._profile               = %s " % (self._profile is not None)
+        txt += "\nself._precision             = %s " % (self._precision           )
         txt += "\nself._verbose               = %s " % (self._verbose             )
         txt += "\n"
         return txt
@@ -1154,4 +2659,4 @@ if __name__ == "__main__":
 
         xx, yy_amplitude, _ = a.xscan_for_external_wavefront(npoints_x=500, a_factor=1.0, a_center=0.0, filename="")  # same as before
 
-        plot(xx, numpy.abs(yy_amplitude) ** 2, xtitle='x [mm]', ytitle="Intensity", title="", grid=1, show=1)
\ No newline at end of file
+        plot(xx, numpy.abs(yy_amplitude) ** 2, xtitle='x [mm]', ytitle="Intensity", title="", grid=1, show=1)
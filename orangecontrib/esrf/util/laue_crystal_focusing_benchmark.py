@@ -0,0 +1,212 @@
+#
+# Benchmark of laue_crystal_focusing: wall time, peak memory and accuracy of each scan type (eq 23, 24, 28, 30, 31
+# and q-scan) at several grid sizes, for the configurations of Guigay & Ferrero 2016 Fig. 2 and Fig. 5.
+#
+# The accuracy is measured against reference arrays stored in laue_crystal_focusing_references.npz, next to this file
+# (missing references are calculated and added to it). The report is written as json, and can be compared with a
+# previous one (baseline) to catch regressions:
+#
+#     python -m orangecontrib.esrf.util.laue_crystal_focusing_benchmark --output report.json
+#     python -m orangecontrib.esrf.util.laue_crystal_focusing_benchmark --output new.json --baseline report.json
+#
+
+import numpy
+import io
+import sys
+import os
+import json
+import time
+import platform
+import tracemalloc
+import contextlib
+
+from orangecontrib.esrf.util.laue_crystal_focusing import LaueCrystalFocusing
+
+CONFIGURATIONS = {
+    "fig5": dict(R=2000, poisson_ratio=0.2201, photon_energy_in_keV=20.0, thickness=0.250, p=29000.0, alfa_deg=2.0),
+    "fig2": dict(R=2000, poisson_ratio=0.2201, photon_energy_in_keV=80.0, thickness=1.0, p=0.0, alfa_deg=-0.05),
+    }
+
+# case name: configuration
+CASES = {
+    "eq23":  "fig2",
+    "eq24":  "fig2",
+    "eq28":  "fig2",
+    "eq30":  "fig5",
+    "eq31":  "fig5",
+    "qscan": "fig5",
+    }
+
+# (number of x or q points, integration_points)
+GRID_SIZES = [(100, 200), (400, 500), (1000, 1000)]
+
+REFERENCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "laue_crystal_focusing_references.npz")
+
+# references: "loop" engine with the Kummer function from mpmath, i.e. independent of the array kernels and of
+# hyp1f1_array, with the trapezoidal rule on REFERENCE_INTEGRATION_POINTS and 2 * REFERENCE_INTEGRATION_POINTS - 1
+# points and Richardson extrapolation (the error is O(h^2)). The eq 28 integrand (a wavefront with steps at its edges)
+# converges as O(h) only: the finer result is used as is.
+REFERENCE_INTEGRATION_POINTS = 1001
+
+def run_case(case, laue, npoints):
+    if case == "eq23":
+        return laue.xscan(q=0, npoints_x=npoints, a_factor=1.0)[1]
+    elif case == "eq24":
+        return laue.xscan(q=1671.1, npoints_x=npoints, a_factor=1.0)[1]
+    elif case == "eq28":
+        return laue.xscan_for_external_wavefront(npoints_x=npoints, a_factor=1.0)[1]
+    elif case == "eq30":
+        return laue.xscan(q=0, npoints_x=npoints, a_factor=2.0)[1]
+    elif case == "eq31":
+        return laue.xscan(q=437.275, npoints_x=npoints, a_factor=3.0)[1]
+    elif case == "qscan":
+        return laue.qscan(qmin=0.0, qmax=10000.0, npoints=npoints)[1]
+    else:
+        raise Exception("Unknown case: %s" % case)
+
+def _reference_key(case, npoints):
+    return "%s_%d" % (case, npoints)
+
+# the calculations print a lot: keep only the benchmark output
+def _quiet_run_case(case, laue, npoints):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_case(case, laue, npoints)
+
+def calculate_reference(case, npoints, n_workers=1):
+    print("Calculating reference %s, %d points..." % (case, npoints))
+    amplitudes = []
+    for integration_points in (REFERENCE_INTEGRATION_POINTS, 2 * REFERENCE_INTEGRATION_POINTS - 1):
+        laue = LaueCrystalFocusing(**CONFIGURATIONS[CASES[case]], integration_points=integration_points,
+                                   use_fast_hyp1f1=0, engine="loop", n_workers=n_workers, verbose=0)
+        amplitudes.append(_quiet_run_case(case, laue, npoints))
+    if case == "eq28":
+        return amplitudes[1]
+    return (4 * amplitudes[1] - amplitudes[0]) / 3
+
+# loads the references from filename, calculating (and saving) the missing ones
+def load_references(filename=REFERENCE_FILE, cases=None, grid_sizes=GRID_SIZES, n_workers=1):
+    if cases is None: cases = list(CASES.keys())
+    references = {}
+    if os.path.exists(filename):
+        with numpy.load(filename) as data:
+            references = {key: data[key] for key in data.files}
+
+    missing = False
+    for case in cases:
+        for npoints in sorted(set(grid[0] for grid in grid_sizes)):
+            if _reference_key(case, npoints) not in references:
+                references[_reference_key(case, npoints)] = calculate_reference(case, npoints, n_workers=n_workers)
+                missing = True
+    if missing:
+        numpy.savez_compressed(filename, **references)
+        print("File %s written to disk" % filename)
+    return references
+
+#
+# runs all cases for all engines and grid sizes. Time is the best of repeat runs (after a warm-up run, that also
+# compiles the numba kernels); the peak memory is the maximum of the python/numpy allocations (tracemalloc) in a
+# separate run; the error is max|amplitude - reference| / max|reference|. use_fast_hyp1f1=None uses mpmath for the
+# "loop" engine (fast_hyp1f1 is not accurate for the Fig. 2 configuration) and hyp1f1_array for the other engines.
+#
+def run_benchmark(reference_file=REFERENCE_FILE, cases=None, grid_sizes=GRID_SIZES,
+                  engines=("loop", "vectorized", "numba"), use_fast_hyp1f1=None, repeat=3, output=""):
+    if cases is None: cases = list(CASES.keys())
+    references = load_references(reference_file, cases=cases, grid_sizes=grid_sizes, n_workers=os.cpu_count() or 1)
+
+    results = []
+    for case in cases:
+        for engine in engines:
+            engine_use_fast_hyp1f1 = use_fast_hyp1f1
+            if engine_use_fast_hyp1f1 is None:
+                engine_use_fast_hyp1f1 = 0 if engine == "loop" else 1
+            for npoints, integration_points in grid_sizes:
+                laue = LaueCrystalFocusing(**CONFIGURATIONS[CASES[case]], integration_points=integration_points,
+                                           use_fast_hyp1f1=engine_use_fast_hyp1f1, engine=engine, verbose=0)
+                _quiet_run_case(case, laue, min(npoints, 10)) # warm-up
+
+                times = []
+                for i in range(repeat):
+                    t0 = time.perf_counter()
+                    amplitude = _quiet_run_case(case, laue, npoints)
+                    times.append(time.perf_counter() - t0)
+
+                tracemalloc.start()
+                _quiet_run_case(case, laue, npoints)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                reference = references[_reference_key(case, npoints)]
+                error = numpy.abs(amplitude - reference).max() / numpy.abs(reference).max()
+
+                result = dict(case=case, configuration=CASES[case], engine=engine,
+                              use_fast_hyp1f1=engine_use_fast_hyp1f1, npoints=npoints,
+                              integration_points=integration_points, time=min(times),
+                              peak_memory_MB=peak_memory / 2**20, error=float(error))
+                print("%-6s %-11s %5d x %5d: time %9.4f s, peak memory %9.2f MB, error %.2e" %
+                      (case, engine, npoints, integration_points, result["time"], result["peak_memory_MB"], error))
+                results.append(result)
+
+    report = dict(created=time.strftime("%Y-%m-%d %H:%M:%S"),
+                  platform=platform.platform(),
+                  python=platform.python_version(),
+                  numpy=numpy.__version__,
+                  repeat=repeat,
+                  results=results)
+
+    if output != "":
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("File %s written to disk" % output)
+
+    return report
+
+#
+# regressions of report with respect to baseline: time larger than time_factor * baseline time (and than baseline time
+# + time_floor, to ignore the noise of very short runs), or error larger than error_factor * baseline error (and than
+# error_floor). Results calculated with a different Kummer function (use_fast_hyp1f1) are not compared.
+#
+def compare_reports(baseline, report, time_factor=1.2, time_floor=0.01, error_factor=10.0, error_floor=1e-12):
+    def key(result):
+        return (result["case"], result["engine"], result["npoints"], result["integration_points"])
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = baseline_results.get(key(result))
+        if old is None: continue
+        # older reports have a single use_fast_hyp1f1 for all results
+        if old.get("use_fast_hyp1f1", baseline.get("use_fast_hyp1f1")) != result["use_fast_hyp1f1"]: continue
+        if result["time"] > max(time_factor * old["time"], old["time"] + time_floor):
+            regressions.append("%s %s %d x %d: time %.4f s (baseline %.4f s)" %
+                               (key(result) + (result["time"], old["time"])))
+        if result["error"] > max(error_factor * old["error"], error_floor):
+            regressions.append("%s %s %d x %d: error %.2e (baseline %.2e)" %
+                               (key(result) + (result["error"], old["error"])))
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark of laue_crystal_focusing")
+    parser.add_argument("--references", default=REFERENCE_FILE,
+                        help="npz file with the reference arrays (missing ones are calculated and added)")
+    parser.add_argument("--output", default="laue_crystal_focusing_benchmark.json", help="json report")
+    parser.add_argument("--baseline", default="", help="json report to compare with")
+    parser.add_argument("--cases", nargs="+", default=list(CASES.keys()), choices=list(CASES.keys()))
+    parser.add_argument("--engines", nargs="+", default=["loop", "vectorized", "numba"],
+                        choices=["loop", "vectorized", "numba"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    report = run_benchmark(reference_file=args.references, cases=args.cases, engines=args.engines,
+                           repeat=args.repeat, output=args.output)
+
+    if args.baseline != "":
+        with open(args.baseline) as f:
+            regressions = compare_reports(json.load(f), report)
+        for regression in regressions:
+            print("REGRESSION: %s" % regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions with respect to %s" % args.baseline)
@@ -106,6 +106,7 @@ PACKAGE_DATA = {
     "orangecontrib.esrf.shadow4.widgets.extension": ["icons/*.png", "icons/*.jpg", "miscellanea/*.txt"],
     "orangecontrib.esrf.wofry.widgets.extension":["icons/*.png", "icons/*.jpg"],
     "orangecontrib.esrf.srw.widgets.extension":["icons/*.png", "icons/*.jpg"],
+    "orangecontrib.esrf.util":["laue_crystal_focusing_references.npz"],
     }
 
 ENTRY_POINTS = {